@@ -1,22 +1,50 @@
 import os
-import json
 import re
 from pathlib import Path
-from moviepy.editor import ImageClip, AudioFileClip, concatenate_videoclips, CompositeVideoClip, CompositeAudioClip, TextClip, VideoFileClip
+from moviepy.editor import ImageClip, AudioFileClip, concatenate_videoclips, CompositeAudioClip, TextClip, VideoFileClip, VideoClip
+from moviepy.audio.fx.all import audio_loop
+from moviepy.config import get_setting
 from pydub import AudioSegment
-import random
+from pydub.silence import detect_silence, detect_leading_silence
+from pydub.utils import mediainfo
+from bisect import bisect_left, bisect_right
+import shutil
+import subprocess
+import tempfile
+import numpy as np
+from PIL import ImageColor, ImageFont
 from natsort import natsorted
+from profile_funcs import profile_section, render_profile, watch_encoder
+from store_funcs import atomic_output, atomic_write, load_json, load_transcript_segments, load_word_times, remove_stale_partials, save_json, save_script
+
+MUSIC_INDEX_FILENAME = "music_index.json"
+TARGET_MUSIC_LOUDNESS = -30.0  # Sonoridad objetivo de la música de fondo (dBFS)
+MIX_SAMPLE_RATE = 44100
+CAPTION_FONT_PATH = 'fonts/KOMIKAX_.ttf'
+CAPTION_STYLES = {
+    "default": {},
+    "white": {"color": "white"},
+    "large": {"fontsize": 100, "stroke_width": 8},
+    "minimal": {"fontsize": 64, "color": "white", "stroke_width": 4},
+}
+RENDITIONS = [
+    {"name": "1080p", "width": 1080, "height": 1920, "bitrate": "6M"},
+    {"name": "720p", "width": 720, "height": 1280, "bitrate": "3M"},
+    {"name": "preview", "width": 360, "height": 640, "bitrate": "400k"},
+]
 
 def create_project_structure(base_path):
     """
     Creates the directory structure for a project given a base directory.
 
+    Temporary folders left by interrupted writes that have not changed for a day are removed.
+
     Args:
     - base_path (str): Base path where project directories will be created.
 
     Returns:
     - tuple: Contains paths of created directories in the following order:
-      (data_dir, video_dir, img_dir, audio_dir, JSON_dir, trans_dir)
+      (data_dir, video_dir, img_dir, audio_dir, JSON_dir, trans_dir, music_dir)
     """
     data_dir = os.path.join(base_path, "data")
     video_dir = os.path.join(data_dir, "video")
@@ -33,6 +61,9 @@ def create_project_structure(base_path):
     os.makedirs(JSON_dir, exist_ok=True)
     os.makedirs(trans_dir, exist_ok=True)
 
+    for path in remove_stale_partials(data_dir):
+        print(f"Removed interrupted write: {path}")
+
     return data_dir, video_dir, img_dir, audio_dir, JSON_dir, trans_dir, music_dir
 
 def sanitize_title(title):
@@ -47,6 +78,18 @@ def sanitize_title(title):
     """
     return title.replace(" ", "_").replace(":", "").replace("/", "_")
 
+def image_title_safe(json_data):
+    """
+    Sanitized title of the project whose images a script uses (its own unless it sets "image_title").
+
+    Args:
+    - json_data (dict): JSON dictionary representing the TikTok video script.
+
+    Returns:
+    - str: Sanitized title naming the image folder.
+    """
+    return sanitize_title(json_data.get("image_title", json_data["title"]))
+
 def count_total_words(scenes):
     total_words = 0
     for scene in scenes:
@@ -66,7 +109,20 @@ def update_and_save_scene_times(input_json, audio_dir, json_dir):
     audio = AudioSegment.from_file(audio_path)
     total_duration = len(audio) / 1000.0  # Convertir a segundos
 
-    scenes = input_json["scenes"]
+    split_scenes_by_word_count(input_json["scenes"], total_duration)
+    return save_scene_times(input_json, json_dir)
+
+def split_scenes_by_word_count(scenes, total_duration):
+    """
+    Set each scene's start and end by splitting the narration in proportion to the words of its script.
+
+    Args:
+    - scenes (list): Scenes of the TikTok video script.
+    - total_duration (float): Duration of the narration in seconds.
+
+    Returns:
+    - list: The same scenes with "start" and "end" set.
+    """
     # Contar el número total de palabras en todas las escenas
     total_words = count_total_words(scenes)
     # Calcular la duración de cada palabra
@@ -81,15 +137,243 @@ def update_and_save_scene_times(input_json, audio_dir, json_dir):
         scene["start"] = current_time
         current_time += scene_duration
         scene["end"] = current_time
+    return scenes
+
+def normalize_token(word):
+    """
+    Normalize a word so script and transcript tokens can be compared.
+
+    Args:
+    - word (str): The word to normalize.
+
+    Returns:
+    - str: Lowercase word without punctuation.
+    """
+    return re.sub(r"[^\w]", "", word.lower())
+
+def build_word_index(words):
+    """
+    Build a normalized token index over the transcript words.
+
+    Args:
+    - words (list): The transcript words, in order.
+
+    Returns:
+    - dict: Maps each normalized token to the ascending list of its word positions.
+    """
+    index = {}
+    for position, word in enumerate(words):
+        index.setdefault(normalize_token(word), []).append(position)
+    return index
+
+def align_scenes_to_transcript(scenes, words, word_times, total_duration, max_skip=8):
+    """
+    Set each scene's start and end by aligning its script against the transcript words.
+
+    Script tokens are matched in order against the transcript using the token index,
+    so the alignment is linear in the number of words. Tokens Whisper transcribed
+    differently are skipped, and scenes with no match are placed by word count
+    between their aligned neighbours. If nothing can be aligned (e.g. the transcript
+    has no words), the narration is split by word count instead.
+
+    Args:
+    - scenes (list): Scenes of the TikTok video script.
+    - words (list): The transcript words, in order.
+    - word_times (ndarray): Structured array with the "start" and "end" of each word (see store_funcs.load_word_times).
+    - total_duration (float): Duration of the narration in seconds.
+    - max_skip (int): Maximum number of transcript words skipped to find a match.
+
+    Returns:
+    - list: The same scenes with "start" and "end" set.
+    """
+    index = build_word_index(words)
+    boundaries = []
+    cursor = 0
+    for scene in scenes:
+        boundary = None
+        for offset, token in enumerate(normalize_token(word) for word in scene["script"].split()):
+            positions = index.get(token)
+            if not token or not positions:
+                continue
+            i = bisect_left(positions, cursor)
+            if i == len(positions) or positions[i] - cursor > max_skip:
+                continue
+            if boundary is None:
+                # Retroceder por las palabras de la escena que no se encontraron
+                boundary = max(cursor, positions[i] - offset)
+            cursor = positions[i] + 1
+        boundaries.append(boundary)
+
+    if all(boundary is None for boundary in boundaries):
+        return split_scenes_by_word_count(scenes, total_duration)
 
+    # Repartir por número de palabras las escenas que no se han podido alinear
+    boundaries[0] = 0
+    word_counts = [len(scene["script"].split()) for scene in scenes]
+    known = [i for i, boundary in enumerate(boundaries) if boundary is not None] + [len(scenes)]
+    for lo, hi in zip(known, known[1:]):
+        hi_position = boundaries[hi] if hi < len(scenes) else len(words)
+        words_between = sum(word_counts[lo:hi]) or 1
+        for i in range(lo + 1, hi):
+            share = sum(word_counts[lo:i]) / words_between
+            boundaries[i] = int(round(boundaries[lo] + (hi_position - boundaries[lo]) * share))
+
+    def cut_time(position):
+        if position <= 0:
+            return 0.0
+        if position >= len(words):
+            return float(word_times["end"][-1]) if len(words) else 0.0
+        # Cortar en el hueco entre la última palabra de una escena y la primera de la siguiente
+        return (float(word_times["end"][position - 1]) + float(word_times["start"][position])) / 2
+
+    starts = [cut_time(boundary) for boundary in boundaries]
+    ends = starts[1:] + [max(total_duration, starts[-1])]
+    for scene, start, end in zip(scenes, starts, ends):
+        scene["start"] = start
+        scene["end"] = max(start, end)
+    return scenes
+
+def update_scene_times_from_transcript(input_json, audio_dir, trans_dir, json_dir):
+    """
+    Update scene times by aligning the scene scripts with the word-level transcription and save the JSON.
+
+    Args:
+    - input_json (dict): JSON dictionary representing the TikTok video script.
+    - audio_dir (str): Directory where the audio files are stored.
+    - trans_dir (str): Directory where the transcription files are stored.
+    - json_dir (str): Directory where the JSON files are stored.
+
+    Returns:
+    - dict: The JSON dictionary with updated scene times.
+    """
+    title_safe = sanitize_title(input_json['title'])
+    transcript_path = os.path.join(trans_dir, title_safe, f"{title_safe}.json")
+    if not os.path.exists(transcript_path):
+        raise FileNotFoundError(f"Transcription file not found: {transcript_path}")
+    audio_path = os.path.join(audio_dir, title_safe, f"{title_safe}.mp3")
+    if not os.path.exists(audio_path):
+        raise FileNotFoundError(f"Audio file not found: {audio_path}")
+
+    # Los tiempos se leen del array mapeado solo en los cortes; las palabras se decodifican para el índice
+    word_times = load_word_times(transcript_path, ["start", "end"])
+    words = [word.decode("utf-8") for word in load_word_times(transcript_path, ["word"])["word"]]
+
+    # Leer la duración de la cabecera sin decodificar el audio
+    total_duration = float(mediainfo(audio_path)["duration"])
+
+    align_scenes_to_transcript(input_json["scenes"], words, word_times, total_duration)
+    return save_scene_times(input_json, json_dir)
+
+def save_scene_times(input_json, json_dir):
+    """
+    Save a script JSON whose scenes already carry their start and end times.
+
+    Args:
+    - input_json (dict): JSON dictionary representing the TikTok video script.
+    - json_dir (str): Directory where the JSON files are stored.
+
+    Returns:
+    - dict: The same JSON dictionary.
+    """
+    title_safe = sanitize_title(input_json['title'])
     title_json_dir = os.path.join(json_dir, title_safe)
     os.makedirs(title_json_dir, exist_ok=True)
-    output_path = os.path.join(title_json_dir, f"{title_safe}.json")
-    with open(output_path, 'w', encoding='utf-8') as file:
-        json.dump(input_json, file, ensure_ascii=False, indent=4)
-
+    save_script(os.path.join(title_json_dir, f"{title_safe}.json"), input_json)
     return input_json
 
+def split_audio_on_silence(audio_path, output_dir, max_chunk_seconds=60, min_silence_len=300, silence_thresh_offset=-16, overlap_seconds=1.0):
+    """
+    Split an audio file at detected silences into chunks of bounded length.
+
+    Args:
+    - audio_path (str): Path to the audio file to split.
+    - output_dir (str): Directory where the chunk files will be written.
+    - max_chunk_seconds (float): Maximum length of each chunk in seconds.
+    - min_silence_len (int): Minimum length of a silence (ms) to be used as a cut point.
+    - silence_thresh_offset (float): Silence threshold relative to the audio's average dBFS.
+    - overlap_seconds (float): Audio shared by both sides of a cut when no silence is found.
+
+    Returns:
+    - list: One dict per chunk with its "path", "offset" (start in the original audio)
+      and the "own_start"/"own_end" window of words it is responsible for, in seconds.
+    """
+    audio = AudioSegment.from_file(audio_path)
+    total_ms = len(audio)
+    max_ms = int(max_chunk_seconds * 1000)
+
+    if total_ms <= max_ms:
+        return [{"path": audio_path, "offset": 0.0, "own_start": 0.0, "own_end": total_ms / 1000.0}]
+
+    # Cortar por la mitad de cada silencio para no partir palabras
+    silences = detect_silence(audio, min_silence_len=min_silence_len, silence_thresh=audio.dBFS + silence_thresh_offset, seek_step=10)
+    cut_points = [(start + end) // 2 for start, end in silences]
+
+    cuts = []
+    start = 0
+    while total_ms - start > max_ms:
+        candidates = [cut for cut in cut_points if start < cut <= start + max_ms]
+        cut = candidates[-1] if candidates else start + max_ms
+        cuts.append((cut, not candidates))
+        start = cut
+
+    overlap_ms = int(overlap_seconds * 1000)
+    chunks = []
+    bounds = [(0, False)] + cuts + [(total_ms, False)]
+    for i in range(len(bounds) - 1):
+        own_start, hard_start = bounds[i]
+        own_end, hard_end = bounds[i + 1]
+        # Los cortes sin silencio se solapan para que ninguna palabra quede partida
+        chunk_start = max(0, own_start - overlap_ms) if hard_start else own_start
+        chunk_end = min(total_ms, own_end + overlap_ms) if hard_end else own_end
+        chunk_path = os.path.join(output_dir, f"chunk_{i}.mp3")
+        audio[chunk_start:chunk_end].export(chunk_path, format="mp3")
+        chunks.append({
+            "path": chunk_path,
+            "offset": chunk_start / 1000.0,
+            "own_start": own_start / 1000.0,
+            "own_end": own_end / 1000.0,
+        })
+
+    return chunks
+
+def merge_chunk_transcriptions(chunks, transcriptions):
+    """
+    Merge per-chunk transcriptions into a single transcription.
+
+    Word timestamps are shifted by each chunk's offset, words outside the chunk's own
+    window are dropped and repeated words at the seams are de-duplicated. The text is
+    rebuilt from the merged words, so words at the seams are not repeated in it either.
+
+    Args:
+    - chunks (list): Chunks as returned by split_audio_on_silence.
+    - transcriptions (list): Transcription data for each chunk, in the same order.
+
+    Returns:
+    - dict: Transcription data including text and segments.
+    """
+    segments = []
+    for chunk, transcription in zip(chunks, transcriptions):
+        for word in transcription["segments"]:
+            start = word["start"] + chunk["offset"]
+            end = word["end"] + chunk["offset"]
+            midpoint = (start + end) / 2
+            if not chunk["own_start"] <= midpoint < chunk["own_end"]:
+                continue
+            if segments:
+                previous = segments[-1]
+                same_word = previous["word"].strip().lower() == word["word"].strip().lower()
+                if start < previous["end"] and same_word:
+                    continue
+                # Evitar solapes residuales entre palabras de chunks distintos
+                start = max(start, previous["end"])
+                end = max(start, end)
+            segments.append({"word": word["word"], "start": start, "end": end})
+
+    return {
+        "text": " ".join(word for word in (segment["word"].strip() for segment in segments) if word),
+        "segments": segments
+    }
+
 def apply_movement_effect(clip, index, tiktok_width, tiktok_height):
     """
     Apply a left-to-right or right-to-left movement effect to a clip based on its index.
@@ -106,19 +390,126 @@ def apply_movement_effect(clip, index, tiktok_width, tiktok_height):
     def move_left_to_right(get_frame, t):
         x = int(t * (clip.w - tiktok_width) / clip.duration)
         x = max(0, min(x, clip.w - tiktok_width))
-        return clip.crop(x1=x, y1=0, width=tiktok_width, height=tiktok_height).get_frame(t)
+        with profile_section("pan"):
+            return clip.crop(x1=x, y1=0, width=tiktok_width, height=tiktok_height).get_frame(t)
 
     def move_right_to_left(get_frame, t):
         x = int((clip.w - tiktok_width) - t * (clip.w - tiktok_width) / clip.duration)
         x = max(0, min(x, clip.w - tiktok_width))
-        return clip.crop(x1=x, y1=0, width=tiktok_width, height=tiktok_height).get_frame(t)
+        with profile_section("pan"):
+            return clip.crop(x1=x, y1=0, width=tiktok_width, height=tiktok_height).get_frame(t)
 
     if index % 2 == 0:
         return clip.fl(move_left_to_right, apply_to=['mask'])
     else:
         return clip.fl(move_right_to_left, apply_to=['mask'])
 
-def generate_video(images_dir, audio_file, output_file, scene_durations, transition_duration=1):
+def rendition_paths(output_path, renditions):
+    """
+    Get the file paths produced next to output_path for each rendition, the poster and the animated preview.
+
+    Args:
+    - output_path (str): Path of the main output video.
+    - renditions (list): Renditions as in RENDITIONS.
+
+    Returns:
+    - dict: Maps each rendition name, "poster" and "animated_preview" to its path.
+    """
+    base, ext = os.path.splitext(output_path)
+    paths = {rendition["name"]: f"{base}_{rendition['name']}{ext}" for rendition in renditions}
+    paths["poster"] = f"{base}_poster.jpg"
+    paths["animated_preview"] = f"{base}_preview.gif"
+    return paths
+
+def rendition_ffmpeg_args(video_input, audio_input, output_path, renditions, poster_frame, preview_seconds=3, prefilter=None, audio_codec="aac", subtitle_input=None):
+    """
+    Build the ffmpeg filtergraph and output arguments that encode one video stream into every rendition.
+
+    The stream is split once inside ffmpeg and fed to the main output, one scaled
+    encoder per rendition, a poster frame and an animated GIF preview.
+
+    Args:
+    - video_input (str): Filtergraph label of the source video (e.g. "0:v").
+    - audio_input (str): Stream specifier of the source audio (e.g. "1:a"), or None.
+    - output_path (str): Path of the main output video.
+    - renditions (list): Renditions as in RENDITIONS.
+    - poster_frame (int): Index of the frame used as poster.
+    - preview_seconds (float): Length of the animated preview.
+    - prefilter (str): Filter applied to the source before it is split (e.g. caption burn-in).
+    - audio_codec (str): Audio codec for the video outputs.
+    - subtitle_input (str): Stream specifier of a subtitle track added to every video output (e.g. "1:s"), or None.
+
+    Returns:
+    - list: ffmpeg arguments to append after the inputs.
+    """
+    paths = rendition_paths(output_path, renditions)
+    split_labels = ["main"] + [f"r{i}" for i in range(len(renditions))] + ["poster", "preview"]
+    source = f"[{video_input}]{prefilter + ',' if prefilter else ''}"
+    graph = [f"{source}split={len(split_labels)}" + "".join(f"[{label}]" for label in split_labels)]
+    for i, rendition in enumerate(renditions):
+        width, height = rendition["width"], rendition["height"]
+        graph.append(f"[r{i}]scale={width}:{height}:force_original_aspect_ratio=decrease,pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1[o{i}]")
+    graph.append(f"[poster]select='eq(n\\,{poster_frame})'[poster_out]")
+    graph.append(f"[preview]trim=duration={preview_seconds},fps=10,scale=270:-2,split[preview_a][preview_b];[preview_a]palettegen[palette];[preview_b][palette]paletteuse[preview_out]")
+
+    audio_args = ["-map", audio_input, "-c:a", audio_codec] if audio_input else []
+    if subtitle_input:
+        audio_args += ["-map", subtitle_input, "-c:s", "mov_text"]
+    args = ["-filter_complex", ";".join(graph)]
+    args += ["-map", "[main]"] + audio_args + ["-c:v", "libx264", "-pix_fmt", "yuv420p", output_path]
+    for i, rendition in enumerate(renditions):
+        bitrate = rendition["bitrate"]
+        args += ["-map", f"[o{i}]"] + audio_args
+        args += ["-c:v", "libx264", "-pix_fmt", "yuv420p", "-b:v", bitrate, "-maxrate", bitrate, "-bufsize", bitrate, paths[rendition["name"]]]
+    args += ["-map", "[poster_out]", "-frames:v", "1", "-update", "1", paths["poster"]]
+    args += ["-map", "[preview_out]", paths["animated_preview"]]
+    return args
+
+def write_renditions(clip, output_path, renditions, fps=24, poster_time=None):
+    """
+    Render a clip's frames once and encode them into the main output and every rendition at the same time.
+
+    Args:
+    - clip (VideoClip): The clip to render.
+    - output_path (str): Path of the main output video.
+    - renditions (list): Renditions as in RENDITIONS.
+    - fps (int): Frames per second of the output.
+    - poster_time (float): Time of the poster frame; defaults to the middle of the clip.
+
+    Returns:
+    - dict: Paths of the renditions, poster and animated preview.
+    """
+    width, height = clip.size
+    poster_time = clip.duration / 2 if poster_time is None else poster_time
+
+    with tempfile.TemporaryDirectory() as render_dir:
+        command = [get_setting("FFMPEG_BINARY"), "-y", "-loglevel", "error",
+                   "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}", "-r", str(fps), "-i", "-"]
+        audio_input = None
+        if clip.audio is not None:
+            # El audio se escribe aparte una sola vez, como hace write_videofile
+            audio_path = os.path.join(render_dir, "audio.wav")
+            clip.audio.write_audiofile(audio_path, fps=MIX_SAMPLE_RATE, codec="pcm_s16le", logger=None)
+            command += ["-i", audio_path]
+            audio_input = "1:a"
+        command += rendition_ffmpeg_args("0:v", audio_input, output_path, renditions, int(poster_time * fps))
+
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+        with watch_encoder(process):
+            try:
+                for frame in clip.iter_frames(fps=fps, dtype="uint8"):
+                    process.stdin.write(frame.tobytes())
+            except BrokenPipeError:
+                pass
+            process.stdin.close()
+            error = process.stderr.read().decode(errors="replace")
+            returncode = process.wait()
+        if returncode != 0:
+            raise RuntimeError(f"ffmpeg failed while writing renditions: {error}")
+
+    return rendition_paths(output_path, renditions)
+
+def generate_video(images_dir, audio_file, output_file, scene_durations, transition_duration=1, renditions=None):
     """
     Function to generate a video from images and a single audio file using scene durations and crossfade transitions.
 
@@ -128,6 +519,7 @@ def generate_video(images_dir, audio_file, output_file, scene_durations, transit
     - output_file (str): Path where the output video will be saved.
     - scene_durations (list): List of durations for each scene in the format [(start, end), ...].
     - transition_duration (float): Duration of the crossfade transition effect.
+    - renditions (list): If given, also encode these renditions, a poster and a preview from the same frames.
 
     Returns:
     - None
@@ -154,8 +546,102 @@ def generate_video(images_dir, audio_file, output_file, scene_durations, transit
     # Concatenate image clips with the specified transitions
     video = concatenate_videoclips(clips, method="compose").set_audio(audio_clip)
 
+    def blend(get_frame, t):
+        with profile_section("blend"):
+            return get_frame(t)
+
     # Write the video file
-    video.write_videofile(output_file, codec="libx264", audio_codec="aac", fps=24)
+    with render_profile(output_file) as profiler, atomic_output(output_file) as temp_file:
+        video = profiler.wrap(video.fl(blend))
+        if renditions:
+            write_renditions(video, temp_file, renditions, fps=24)
+        else:
+            video.write_videofile(temp_file, codec="libx264", audio_codec="aac", fps=24)
+
+def scene_frame_range(start, end, fps=24):
+    """
+    Get the frames covered by a scene, rounding its boundaries to the frame grid.
+
+    Consecutive scenes share their rounded boundary, so segments rendered separately
+    add up to exactly the frames of the whole narration.
+
+    Returns:
+    - tuple: (first frame, number of frames)
+    """
+    first, last = round(start * fps), round(end * fps)
+    return first, max(1, last - first)
+
+def render_scene_segment(image_path, index, start, end, output_path, fps=24):
+    """
+    Render one scene into a video-only segment that can be joined with the others without re-encoding.
+
+    Args:
+    - image_path (str): Path to the scene image.
+    - index (int): Index of the scene, which sets the movement direction.
+    - start (float): Start time of the scene in the narration.
+    - end (float): End time of the scene in the narration.
+    - output_path (str): Path where the segment will be saved.
+    - fps (int): Frames per second of the segment.
+
+    Returns:
+    - str: Path to the segment.
+    """
+    _, n_frames = scene_frame_range(start, end, fps)
+    clip = ImageClip(image_path).set_duration(n_frames / fps)
+    tiktok_height = clip.h
+    tiktok_width = int(tiktok_height * 9 / 16)
+    clip = apply_movement_effect(clip, index, tiktok_width, tiktok_height)
+    width, height = clip.size
+
+    # Los frames se escriben uno a uno para que cada segmento tenga exactamente n_frames
+    with render_profile(output_path) as profiler, atomic_output(output_path) as temp_path:
+        command = [get_setting("FFMPEG_BINARY"), "-y", "-loglevel", "error",
+                   "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}", "-r", str(fps), "-i", "-",
+                   "-an", "-c:v", "libx264", "-pix_fmt", "yuv420p", temp_path]
+        clip = profiler.wrap(clip)
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+        with watch_encoder(process):
+            try:
+                for i in range(n_frames):
+                    process.stdin.write(clip.get_frame(i / fps).astype("uint8").tobytes())
+            except BrokenPipeError:
+                pass
+            process.stdin.close()
+            error = process.stderr.read().decode(errors="replace")
+            returncode = process.wait()
+        if returncode != 0:
+            raise RuntimeError(f"ffmpeg failed while rendering {output_path}: {error}")
+    return output_path
+
+def concat_video_segments(segment_paths, audio_file, output_file, renditions=None, poster_frame=0):
+    """
+    Join video segments in order and add the narration, copying the video stream.
+
+    Args:
+    - segment_paths (list): Paths to the segments, in playback order.
+    - audio_file (str): Path to the narration audio.
+    - output_file (str): Path where the output video will be saved.
+    - renditions (list): If given, re-encode the joined video into these renditions, a poster and a preview.
+    - poster_frame (int): Index of the frame used as poster when renditions are given.
+
+    Returns:
+    - str: Path to the output video.
+    """
+    with tempfile.TemporaryDirectory() as concat_dir, atomic_output(output_file) as temp_file:
+        list_path = os.path.join(concat_dir, "segments.txt")
+        with open(list_path, "w", encoding="utf-8") as file:
+            for path in segment_paths:
+                escaped = os.path.abspath(path).replace("'", "'\\''")
+                file.write(f"file '{escaped}'\n")
+
+        command = [get_setting("FFMPEG_BINARY"), "-y", "-loglevel", "error",
+                   "-f", "concat", "-safe", "0", "-i", list_path, "-i", audio_file]
+        if renditions:
+            command += rendition_ffmpeg_args("0:v", "1:a", temp_file, renditions, poster_frame)
+        else:
+            command += ["-map", "0:v", "-map", "1:a", "-c:v", "copy", "-c:a", "aac", temp_file]
+        subprocess.run(command, check=True)
+    return output_file
 
 def generate_word_by_word_clips(segments, video_size, fontsize=80, color='yellow', stroke_color='black', stroke_width=6):
     """
@@ -173,7 +659,7 @@ def generate_word_by_word_clips(segments, video_size, fontsize=80, color='yellow
     Returns:
     - list: List of TextClip objects representing each word with animation effects.
     """
-    font_path = 'fonts/KOMIKAX_.ttf'
+    font_path = CAPTION_FONT_PATH
     clips = []
 
     for word_info in segments:
@@ -197,24 +683,228 @@ def generate_word_by_word_clips(segments, video_size, fontsize=80, color='yellow
 
     return clips
 
-def generate_animated_subtitles(video_path, segments):
+def build_overlay_sprite(clip, frame_size):
+    """
+    Render a static overlay clip once into a sprite clipped to the frame.
+
+    Args:
+    - clip (VideoClip): Overlay clip with a start, duration and position.
+    - frame_size (tuple): Size of the base video (width, height).
+
+    Returns:
+    - dict: Sprite with its "start", "end", bounding box ("x0", "y0", "x1", "y1"),
+      float "rgb" pixels and float "alpha" mask, or None if it falls outside the frame.
+    """
+    frame_w, frame_h = frame_size
+    rgb = clip.get_frame(0).astype(np.float32)
+    alpha = clip.mask.get_frame(0).astype(np.float32) if clip.mask is not None else np.ones(rgb.shape[:2], dtype=np.float32)
+    sprite_h, sprite_w = alpha.shape
+
+    pos = clip.pos(0)
+    if isinstance(pos, str):
+        pos = {'center': ['center', 'center'], 'left': ['left', 'center'], 'right': ['right', 'center'],
+               'top': ['center', 'top'], 'bottom': ['center', 'bottom']}[pos]
+    pos = list(pos)
+    if clip.relative_pos:
+        pos = [dim * p if not isinstance(p, str) else p for dim, p in zip((frame_w, frame_h), pos)]
+    if isinstance(pos[0], str):
+        pos[0] = {'left': 0, 'center': (frame_w - sprite_w) / 2, 'right': frame_w - sprite_w}[pos[0]]
+    if isinstance(pos[1], str):
+        pos[1] = {'top': 0, 'center': (frame_h - sprite_h) / 2, 'bottom': frame_h - sprite_h}[pos[1]]
+    x, y = int(pos[0]), int(pos[1])
+
+    # Recortar el sprite a los límites del frame
+    x0, y0 = max(0, x), max(0, y)
+    x1, y1 = min(frame_w, x + sprite_w), min(frame_h, y + sprite_h)
+    if x0 >= x1 or y0 >= y1:
+        return None
+    return {
+        "start": clip.start,
+        "end": clip.end,
+        "x0": x0, "y0": y0, "x1": x1, "y1": y1,
+        "rgb": rgb[y0 - y:y1 - y, x0 - x:x1 - x],
+        "alpha": alpha[y0 - y:y1 - y, x0 - x:x1 - x, None],
+    }
+
+def composite_overlays(video, clips):
+    """
+    Composite static overlay clips onto a video, touching only the pixels they cover.
+
+    Overlays are kept in an interval index sorted by start time, so the active ones at
+    any time are found with a bisect. Frames with no active overlay are returned
+    untouched, and otherwise each overlay is blended only inside its bounding box.
+
+    Args:
+    - video (VideoClip): The base video.
+    - clips (list): Overlay clips (e.g. TextClip) with start, duration and position set.
+
+    Returns:
+    - VideoClip: Video with the overlays, keeping the base video's audio and fps.
+    """
+    sprites = [build_overlay_sprite(clip, video.size) for clip in clips]
+    # Orden estable por inicio: se conserva el orden de capas (sombra debajo de la palabra)
+    sprites = sorted((sprite for sprite in sprites if sprite is not None), key=lambda sprite: sprite["start"])
+    starts = [sprite["start"] for sprite in sprites]
+    longest = max((sprite["end"] - sprite["start"] for sprite in sprites), default=0)
+
+    def active_sprites(t):
+        active = []
+        i = bisect_right(starts, t) - 1
+        while i >= 0 and starts[i] > t - longest - 1e-9:
+            if sprites[i]["end"] > t:
+                active.append(sprites[i])
+            i -= 1
+        return active[::-1]
+
+    def make_frame(t):
+        with profile_section("base"):
+            frame = video.get_frame(t)
+        active = active_sprites(t)
+        if not active:
+            return frame
+        with profile_section("captions"):
+            frame = frame.copy()
+            for sprite in active:
+                region = frame[sprite["y0"]:sprite["y1"], sprite["x0"]:sprite["x1"]]
+                alpha = sprite["alpha"]
+                region[:] = (alpha * sprite["rgb"] + (1 - alpha) * region).astype(np.uint8)
+        return frame
+
+    composite = VideoClip(make_frame, duration=video.duration)
+    composite.fps = video.fps
+    return composite.set_audio(video.audio)
+
+def generate_animated_subtitles(video_path, segments, style=None):
     """
     Generate animated subtitles for a video.
 
     Args:
     - video_path (str): Path to the video file.
     - segments (list): List of segments containing words and their timestamps.
-    - font_path (str): Path to the font file to be used for the text.
+    - style (dict): Caption style overrides, as in CAPTION_STYLES.
 
     Returns:
-    - CompositeVideoClip: Composite video with the original video and animated subtitles.
+    - VideoClip: Video with the original frames and animated subtitles.
     """
     video = VideoFileClip(video_path)
-    clips = generate_word_by_word_clips(segments, video.size)
-    composite = CompositeVideoClip([video] + clips)
-    return composite
+    clips = generate_word_by_word_clips(segments, video.size, **(style or {}))
+    return composite_overlays(video, clips)
+
+def ass_color(color):
+    """
+    Convert a color name or hex string into an ASS &HAABBGGRR color.
+    """
+    red, green, blue = ImageColor.getrgb(color)[:3]
+    return f"&H00{blue:02X}{green:02X}{red:02X}"
+
+def ass_time(seconds):
+    """
+    Format seconds as an ASS H:MM:SS.cc timestamp.
+    """
+    centiseconds = int(round(max(0.0, seconds) * 100))
+    hours, centiseconds = divmod(centiseconds, 360000)
+    minutes, centiseconds = divmod(centiseconds, 6000)
+    secs, centiseconds = divmod(centiseconds, 100)
+    return f"{hours}:{minutes:02d}:{secs:02d}.{centiseconds:02d}"
+
+def write_ass_subtitles(segments, video_size, ass_path, fontsize=80, color='yellow', stroke_color='black', stroke_width=6, shadow_offset=5):
+    """
+    Write the transcription words as a styled ASS subtitle file, one event per word.
+
+    The style mirrors generate_word_by_word_clips: uppercase words in the caption font,
+    yellow with a black stroke, a black drop shadow, centered at 75% of the height.
+
+    Args:
+    - segments (list): List of segments containing words and their timestamps.
+    - video_size (tuple): Size of the video (width, height).
+    - ass_path (str): Path where the ASS file will be saved.
+    - fontsize (int): Font size of the text.
+    - color (str): Color of the text.
+    - stroke_color (str): Stroke color for the text.
+    - stroke_width (int): Stroke width for the text.
+    - shadow_offset (int): Offset of the drop shadow in pixels.
+
+    Returns:
+    - str: Path to the saved ASS file.
+    """
+    width, height = video_size
+    font_name = ImageFont.truetype(CAPTION_FONT_PATH, fontsize).getname()[0]
+    x_pos, y_pos = width // 2, int(height * 0.75)
+
+    lines = [
+        "[Script Info]",
+        "ScriptType: v4.00+",
+        f"PlayResX: {width}",
+        f"PlayResY: {height}",
+        "WrapStyle: 2",
+        "ScaledBorderAndShadow: yes",
+        "",
+        "[V4+ Styles]",
+        "Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding",
+        # ImageMagick centra el trazo sobre el contorno, ASS lo dibuja solo hacia fuera
+        f"Style: Caption,{font_name},{fontsize},{ass_color(color)},{ass_color(color)},{ass_color(stroke_color)},{ass_color('black')},0,0,0,0,100,100,0,0,1,{stroke_width / 2:g},{shadow_offset},8,0,0,0,1",
+        "",
+        "[Events]",
+        "Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text",
+    ]
+    for word_info in segments:
+        word = word_info['word'].upper().replace("\\", "").replace("{", "").replace("}", "").strip()
+        lines.append(f"Dialogue: 0,{ass_time(word_info['start'])},{ass_time(word_info['end'])},Caption,,0,0,0,,{{\\pos({x_pos},{y_pos})}}{word}")
+
+    with atomic_write(ass_path) as file:
+        file.write("\n".join(lines) + "\n")
+    return ass_path
+
+def escape_filter_path(path):
+    """
+    Escape a file path for use as an option value inside an ffmpeg filtergraph.
+    """
+    value = path.replace("\\", "/").replace("'", "\\'").replace(":", "\\:")
+    return "".join("\\" + char if char in "\\'[],;" else char for char in value)
+
+def burn_ass_subtitles(video_path, ass_path, output_path, soft=False, renditions=None):
+    """
+    Add an ASS subtitle file to a video with ffmpeg.
 
-def add_subtitles_to_video(input_json, video_dir, trans_dir):
+    Burn-in renders the captions with libass in the same pass as the video encode; the
+    soft-sub mode copies the streams and adds the captions as a subtitle track (with
+    renditions, the video is encoded once into every rendition, each with the track).
+
+    Args:
+    - video_path (str): Path to the video file.
+    - ass_path (str): Path to the ASS subtitle file.
+    - output_path (str): Path where the output video will be saved.
+    - soft (bool): Add a selectable subtitle track instead of burning the captions in.
+    - renditions (list): If given, also encode these renditions, a poster and a preview in the same pass.
+
+    Returns:
+    - str: Path to the output video.
+    """
+    ffmpeg = get_setting("FFMPEG_BINARY")
+    with atomic_output(output_path) as temp_path:
+        if renditions:
+            video_clip = VideoFileClip(video_path, audio=False)
+            poster_frame = int(video_clip.duration / 2 * video_clip.fps)
+            video_clip.close()
+        if soft:
+            # MP4 solo admite mov_text; el .ass con estilo se conserva junto al video
+            command = [ffmpeg, "-y", "-loglevel", "error", "-i", video_path, "-i", ass_path]
+            if renditions:
+                command += rendition_ffmpeg_args("0:v", "0:a?", temp_path, renditions, poster_frame, audio_codec="copy", subtitle_input="1:s")
+            else:
+                command += ["-map", "0", "-map", "1", "-c", "copy", "-c:s", "mov_text", temp_path]
+        else:
+            fonts_dir = os.path.dirname(os.path.abspath(CAPTION_FONT_PATH))
+            subtitle_filter = f"ass=filename={escape_filter_path(os.path.abspath(ass_path))}:fontsdir={escape_filter_path(fonts_dir)}"
+            command = [ffmpeg, "-y", "-loglevel", "error", "-i", video_path]
+            if renditions:
+                command += rendition_ffmpeg_args("0:v", "0:a?", temp_path, renditions, poster_frame, prefilter=subtitle_filter, audio_codec="copy")
+            else:
+                command += ["-vf", subtitle_filter, "-c:v", "libx264", "-c:a", "copy", temp_path]
+        subprocess.run(command, check=True)
+    return output_path
+
+def add_subtitles_to_video(input_json, video_dir, trans_dir, engine="moviepy", soft=False, renditions=None):
     """
     Add animated subtitles to a video based on transcription JSON data.
 
@@ -222,7 +912,9 @@ def add_subtitles_to_video(input_json, video_dir, trans_dir):
     - input_json (dict): JSON dictionary representing the TikTok video script.
     - video_dir (str): Directory where the video files are stored.
     - trans_dir (str): Directory where the transcription files are stored.
-    - font_path (str): Path to the font file to be used for the text.
+    - engine (str): Caption engine, "moviepy" for TextClip layers or "ass" for libass through ffmpeg.
+    - soft (bool): With the "ass" engine, add a subtitle track instead of burning the captions in.
+    - renditions (list): If given, also encode these renditions, a poster and a preview from the captioned frames.
 
     Returns:
     - None
@@ -242,22 +934,333 @@ def add_subtitles_to_video(input_json, video_dir, trans_dir):
         print(f"Output file already exists: {output_path}")
         return
 
-    with open(transcript_path, 'r', encoding='utf-8') as file:
-        transcript_json = json.load(file)
-
-    segments = transcript_json["segments"]
-    composite = generate_animated_subtitles(video_path, segments)
-    composite.write_videofile(output_path, codec='libx264', audio_codec='aac')
+    segments = load_transcript_segments(transcript_path)
+    ass_path = os.path.join(trans_dir, title_safe, f"{title_safe}.ass")
+    caption_video(video_path, segments, output_path, ass_path, engine=engine, soft=soft, renditions=renditions)
 
     print(f"Subtitled video created successfully: {output_path}")
 
-def add_background_music_to_video(video_path, music_dir):
+def caption_video(video_path, segments, output_path, ass_path, engine="moviepy", soft=False, renditions=None, style=None):
+    """
+    Add word-by-word captions to a video with the selected caption engine.
+
+    Args:
+    - video_path (str): Path to the caption-free video.
+    - segments (list): List of segments containing words and their timestamps.
+    - output_path (str): Path where the output video will be saved.
+    - ass_path (str): Path where the ASS file is written (ass engine only).
+    - engine (str): Caption engine, "moviepy" for TextClip layers or "ass" for libass through ffmpeg.
+    - soft (bool): With the "ass" engine, add a subtitle track instead of burning the captions in.
+    - renditions (list): If given, also encode these renditions, a poster and a preview from the captioned frames.
+    - style (dict): Caption style overrides, as in CAPTION_STYLES.
+
+    Returns:
+    - str: Path to the output video.
+    """
+    style = style or {}
+    if engine == "ass":
+        video_clip = VideoFileClip(video_path, audio=False)
+        video_size = video_clip.size
+        video_clip.close()
+        write_ass_subtitles(segments, video_size, ass_path, **style)
+        burn_ass_subtitles(video_path, ass_path, output_path, soft=soft, renditions=renditions)
+    else:
+        composite = generate_animated_subtitles(video_path, segments, style)
+        with render_profile(output_path) as profiler, atomic_output(output_path) as temp_path:
+            composite = profiler.wrap(composite)
+            if renditions:
+                write_renditions(composite, temp_path, renditions, fps=composite.fps)
+            else:
+                composite.write_videofile(temp_path, codec='libx264', audio_codec='aac')
+    return output_path
+
+def measure_loudness(segment, block_ms=400):
+    """
+    Measure the integrated loudness of an audio segment using gated 400 ms blocks.
+
+    Blocks below -70 dBFS, and then blocks more than 10 dB below the average of the
+    remaining ones, are ignored, so silences and fades do not pull the value down.
+
+    Args:
+    - segment (AudioSegment): The audio to measure.
+    - block_ms (int): Length of each measurement block in milliseconds.
+
+    Returns:
+    - float: Integrated loudness in dBFS.
+    """
+    samples = np.array(segment.get_array_of_samples(), dtype=np.float64)
+    samples = samples.reshape(-1, segment.channels).mean(axis=1) / float(1 << (8 * segment.sample_width - 1))
+    block_size = max(1, int(segment.frame_rate * block_ms / 1000))
+    block_count = max(1, len(samples) // block_size)
+    blocks = np.resize(samples, block_count * block_size).reshape(block_count, block_size)
+    energy = np.mean(blocks ** 2, axis=1) + 1e-12
+
+    gated = energy[10 * np.log10(energy) > -70.0]
+    if gated.size == 0:
+        return -70.0
+    relative_gate = 10 * np.log10(gated.mean()) - 10.0
+    gated = gated[10 * np.log10(gated) > relative_gate]
+    return float(10 * np.log10(gated.mean()))
+
+def analyze_music_track(music_path):
+    """
+    Decode a music track once and measure its duration, loudness and loop points.
+
+    Args:
+    - music_path (str): Path to the music file.
+
+    Returns:
+    - dict: Track information with "duration", "loudness", "loop_start" and "loop_end" (seconds).
+    """
+    track = AudioSegment.from_file(music_path)
+    # El bucle empieza tras el silencio inicial y acaba antes del silencio final
+    loop_start = detect_leading_silence(track)
+    loop_end = len(track) - detect_leading_silence(track.reverse())
+    if loop_end <= loop_start:
+        loop_start, loop_end = 0, len(track)
+    return {
+        "duration": len(track) / 1000.0,
+        "loudness": measure_loudness(track),
+        "loop_start": loop_start / 1000.0,
+        "loop_end": loop_end / 1000.0,
+    }
+
+def update_music_index(music_dir):
+    """
+    Load the music index of a folder, analyzing only tracks that are new or whose mtime changed.
+
+    Args:
+    - music_dir (str): Directory containing the music files.
+
+    Returns:
+    - dict: Music index mapping each file name to its track information.
+    """
+    index_path = os.path.join(music_dir, MUSIC_INDEX_FILENAME)
+    index = {}
+    if os.path.exists(index_path):
+        index = load_json(index_path)
+
+    updated = {}
+    changed = False
+    for entry in os.scandir(music_dir):
+        if not entry.name.endswith('.mp3'):
+            continue
+        stat = entry.stat()
+        track = index.get(entry.name)
+        if track is None or track["mtime"] != stat.st_mtime or track["size"] != stat.st_size:
+            print(f"Indexing music track: {entry.name}")
+            track = analyze_music_track(entry.path)
+            track.update({"mtime": stat.st_mtime, "size": stat.st_size})
+            changed = True
+        updated[entry.name] = track
+
+    if changed or updated.keys() != index.keys():
+        save_json(index_path, updated)
+    return updated
+
+def select_music_track(music_index, target_duration, target_loudness=TARGET_MUSIC_LOUDNESS):
+    """
+    Pick the music track that best fits a video from the music index.
+
+    Tracks whose loop is long enough are preferred, taking the one with the least
+    excess; otherwise the longest loop is used and repeated.
+
+    Args:
+    - music_index (dict): Music index as returned by update_music_index.
+    - target_duration (float): Duration of the video in seconds.
+    - target_loudness (float): Loudness the music should be brought to, in dBFS.
+
+    Returns:
+    - tuple: (file name, track information, gain in dB to reach the target loudness)
+    """
+    if not music_index:
+        raise FileNotFoundError("No music tracks found in the music index")
+
+    def loop_length(item):
+        return item[1]["loop_end"] - item[1]["loop_start"]
+
+    long_enough = [item for item in music_index.items() if loop_length(item) >= target_duration]
+    if long_enough:
+        name, track = min(long_enough, key=loop_length)
+    else:
+        name, track = max(music_index.items(), key=loop_length)
+    return name, track, target_loudness - track["loudness"]
+
+def audio_segment_to_array(segment):
+    """
+    Convert an AudioSegment into a float array of shape (samples, channels) in [-1, 1].
+    """
+    samples = np.array(segment.get_array_of_samples(), dtype=np.float32)
+    return samples.reshape(-1, segment.channels) / float(1 << (8 * segment.sample_width - 1))
+
+def array_to_audio_segment(samples, sample_rate):
+    """
+    Convert a float array of shape (samples, channels) into a 16-bit AudioSegment.
+    """
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16)
+    return AudioSegment(data=pcm.tobytes(), sample_width=2, frame_rate=sample_rate, channels=samples.shape[1])
+
+def duck_music_under_narration(narration, music, sample_rate, duck_db=-12.0, threshold_db=-45.0, attack_ms=80, release_ms=400, hop_ms=10, ceiling_db=-1.0):
+    """
+    Mix music under a narration, lowering the music only while speech is present.
+
+    The whole buffer is processed at once with NumPy: a per-hop narration envelope
+    decides where speech is, the ducking gain ramps down over attack_ms before speech
+    and back up over release_ms after it, and a peak limiter keeps the mix under
+    ceiling_db.
+
+    Args:
+    - narration (ndarray): Narration samples of shape (samples, channels) in [-1, 1].
+    - music (ndarray): Music samples with the same shape as the narration.
+    - sample_rate (int): Sample rate of both signals.
+    - duck_db (float): Gain applied to the music while speech is present.
+    - threshold_db (float): Narration level above which a hop counts as speech.
+    - attack_ms (int): Time the music takes to duck before speech starts.
+    - release_ms (int): Time the music takes to recover after speech ends.
+    - hop_ms (int): Length of each envelope hop in milliseconds.
+    - ceiling_db (float): Maximum peak level of the mix.
+
+    Returns:
+    - ndarray: The mixed samples.
+    """
+    hop = max(1, int(sample_rate * hop_ms / 1000))
+    total = len(narration)
+    hops = -(-total // hop)
+
+    # Envolvente de la narración por bloques de hop muestras
+    mono = np.zeros(hops * hop, dtype=np.float32)
+    mono[:total] = sum(narration[:, channel] for channel in range(narration.shape[1])) / narration.shape[1]
+    energy = np.mean(mono.reshape(hops, hop) ** 2, axis=1)
+    speech = 10 * np.log10(energy + 1e-12) > threshold_db
+
+    # Distancia (en hops) a la voz anterior y a la siguiente
+    positions = np.arange(hops)
+    last_speech = np.maximum.accumulate(np.where(speech, positions, -hops * 2))
+    next_speech = np.minimum.accumulate(np.where(speech, positions, hops * 3)[::-1])[::-1]
+    release = np.clip(1 - (positions - last_speech) / max(1, release_ms / hop_ms), 0, 1)
+    attack = np.clip(1 - (next_speech - positions) / max(1, attack_ms / hop_ms), 0, 1)
+    amount = np.maximum(release, attack)
+
+    ramp = np.arange(hop, dtype=np.float32) / hop
+
+    def per_sample(hop_gain):
+        # Interpolación lineal de la ganancia entre el inicio de cada hop y el siguiente
+        hop_gain = hop_gain.astype(np.float32)
+        following = np.append(hop_gain[1:], hop_gain[-1])
+        return (hop_gain[:, None] + (following - hop_gain)[:, None] * ramp).ravel()[:total, None]
+
+    mixed = narration + music * per_sample(10 ** (duck_db * amount / 20))
+
+    # Limitador de picos: cada hop y sus vecinos no superan el techo
+    ceiling = 10 ** (ceiling_db / 20)
+    peaks = np.zeros((hops * hop, mixed.shape[1]), dtype=np.float32)
+    peaks[:total] = np.abs(mixed)
+    limit = np.minimum(1.0, ceiling / np.maximum(peaks.reshape(hops, -1).max(axis=1), 1e-9))
+    limit = np.minimum(limit, np.minimum(np.roll(limit, 1), np.roll(limit, -1)))
+    mixed *= per_sample(limit)
+    return np.clip(mixed, -ceiling, ceiling, out=mixed)
+
+def replace_video_audio(video_path, audio_path, output_path):
+    """
+    Replace the audio track of a video without re-encoding the video stream.
+
+    Args:
+    - video_path (str): Path to the video file.
+    - audio_path (str): Path to the new audio track.
+    - output_path (str): Path where the output video will be saved.
+
+    Returns:
+    - str: Path to the output video.
+    """
+    with atomic_output(output_path) as temp_path:
+        subprocess.run([
+            get_setting("FFMPEG_BINARY"), "-y", "-loglevel", "error",
+            "-i", video_path, "-i", audio_path,
+            "-map", "0:v", "-map", "0:s?", "-map", "1:a",
+            "-c:v", "copy", "-c:s", "copy", "-c:a", "aac", "-shortest",
+            temp_path,
+        ], check=True)
+    return output_path
+
+def mix_music_with_ducking(video_path, music_dir, output_path, music_name=None, ducking=True):
+    """
+    Mix background music into a video, ducking it under the narration, and remux the result.
+
+    Args:
+    - video_path (str): Path to the video file.
+    - music_dir (str): Directory containing the music files.
+    - output_path (str): Path where the output video will be saved.
+    - music_name (str): Music file to use; picked from the music index when not given.
+    - ducking (bool): Lower the music under the narration; otherwise mix it at a constant level.
+
+    Returns:
+    - str: Path to the output video.
+    """
+    narration = AudioSegment.from_file(video_path).set_frame_rate(MIX_SAMPLE_RATE).set_channels(2)
+    narration_samples = audio_segment_to_array(narration)
+    total = len(narration_samples)
+
+    music_index = update_music_index(music_dir)
+    if music_name is None:
+        music_name, track, gain_db = select_music_track(music_index, total / MIX_SAMPLE_RATE)
+    elif music_name in music_index:
+        track = music_index[music_name]
+        gain_db = TARGET_MUSIC_LOUDNESS - track["loudness"]
+    else:
+        raise FileNotFoundError(f"Music track not found in {music_dir}: {music_name}")
+    print(f"Selected music track: {music_name} ({gain_db:+.1f} dB)")
+
+    music = AudioSegment.from_file(os.path.join(music_dir, music_name))
+    music = music[int(track["loop_start"] * 1000):int(track["loop_end"] * 1000)]
+    music_samples = audio_segment_to_array(music.set_frame_rate(MIX_SAMPLE_RATE).set_channels(2))
+    music_samples *= 10 ** (gain_db / 20)
+    if len(music_samples) >= total:
+        music_samples = music_samples[len(music_samples) - total:]
+    else:
+        music_samples = np.tile(music_samples, (-(-total // len(music_samples)), 1))[:total]
+
+    if ducking:
+        mixed = duck_music_under_narration(narration_samples, music_samples, MIX_SAMPLE_RATE)
+    else:
+        mixed = np.clip(narration_samples + music_samples, -1.0, 1.0)
+
+    with tempfile.TemporaryDirectory() as mix_dir:
+        mix_path = os.path.join(mix_dir, "mix.wav")
+        array_to_audio_segment(mixed, MIX_SAMPLE_RATE).export(mix_path, format="wav")
+        replace_video_audio(video_path, mix_path, output_path)
+    return output_path
+
+def add_music_to_renditions(music_video_path, rendition_videos):
+    """
+    Copy the mixed audio of a video with music into its renditions, copying their video streams.
+
+    The music is mixed once for the main video; the renditions keep their own encodes
+    (and bitrate caps) and only get the new audio track.
+
+    Args:
+    - music_video_path (str): Path to the main video with music, as returned by add_background_music_to_video.
+    - rendition_videos (list): Paths to the rendition videos.
+
+    Returns:
+    - list: Paths to the renditions with music, named "<rendition>_music.mp4".
+    """
+    outputs = []
+    for video_path in rendition_videos:
+        base, ext = os.path.splitext(video_path)
+        output_path = f"{base}_music{ext}"
+        if not os.path.exists(output_path):
+            replace_video_audio(video_path, music_video_path, output_path)
+        outputs.append(output_path)
+    return outputs
+
+def add_background_music_to_video(video_path, music_dir, ducking=False):
     """
     Add background music to a video.
 
     Args:
     - video_path (str): Path to the video file.
     - music_dir (str): Directory containing the music files.
+    - ducking (bool): Lower the music under the narration and remux instead of re-encoding the video.
 
     Returns:
     - str: Path to the output video file with background music.
@@ -270,24 +1273,32 @@ def add_background_music_to_video(video_path, music_dir):
         print(f"Output file already exists: {output_path}")
         return output_path
 
+    if ducking:
+        mix_music_with_ducking(video_path, music_dir, output_path)
+        print(f"Video with background music created successfully: {output_path}")
+        return output_path
+
     # Cargar el video
     video_clip = VideoFileClip(video_path)
     
     # Obtener el audio original del video
     original_audio = video_clip.audio
 
-    # Seleccionar un archivo de música aleatorio
-    music_files = [os.path.join(music_dir, f) for f in os.listdir(music_dir) if f.endswith('.mp3')]
-    audio_path = random.choice(music_files)
-    
-    # Cargar el audio
-    audio_clip = AudioFileClip(audio_path)
-    
-    # Reducir el volumen de la música al 25%
-    audio_clip = audio_clip.volumex(0.2)
-    
+    # Seleccionar la pista que mejor encaja según el índice de música
+    music_index = update_music_index(music_dir)
+    music_name, track, gain_db = select_music_track(music_index, video_clip.duration)
+    print(f"Selected music track: {music_name} ({gain_db:+.1f} dB)")
+
+    # Cargar el audio y normalizar su volumen a la sonoridad objetivo
+    audio_clip = AudioFileClip(os.path.join(music_dir, music_name))
+    audio_clip = audio_clip.volumex(10 ** (gain_db / 20))
+
     # Ajustar la duración del audio para que coincida con la duración del video
-    audio_clip = audio_clip.subclip(max(0, audio_clip.duration - video_clip.duration), audio_clip.duration)
+    loop_start, loop_end = track["loop_start"], track["loop_end"]
+    if loop_end - loop_start >= video_clip.duration:
+        audio_clip = audio_clip.subclip(loop_end - video_clip.duration, loop_end)
+    else:
+        audio_clip = audio_loop(audio_clip.subclip(loop_start, loop_end), duration=video_clip.duration)
     
     # Combinar el audio original con la música de fondo
     combined_audio = CompositeAudioClip([original_audio, audio_clip])
@@ -296,6 +1307,67 @@ def add_background_music_to_video(video_path, music_dir):
     video_with_audio = video_clip.set_audio(combined_audio)
     
     # Guardar el video resultante
-    video_with_audio.write_videofile(output_path, codec='libx264', audio_codec='aac')
+    with render_profile(output_path) as profiler, atomic_output(output_path) as temp_path:
+        profiler.wrap(video_with_audio).write_videofile(temp_path, codec='libx264', audio_codec='aac')
+
+    print(f"Video with background music created successfully: {output_path}")
+    return output_path
+
+def render_style_variants(input_json, video_dir, trans_dir, music_dir, variants, engine="ass"):
+    """
+    Derive style variants (captions and music) from the cached caption-free render.
+
+    The base video from step 7 is never rendered again. Each caption style is
+    composited onto it once and shared by every variant using that style, and music
+    is added by remixing the audio and copying the video stream. Outputs are named
+    "<title>_variant-<name>.mp4", so variants never overwrite each other.
+
+    Args:
+    - input_json (dict): JSON dictionary representing the TikTok video script.
+    - video_dir (str): Directory where the video files are stored.
+    - trans_dir (str): Directory where the transcription files are stored.
+    - music_dir (str): Directory containing the music files.
+    - variants (list): Variants as dicts with a "name", an optional "captions" style
+      (a key of CAPTION_STYLES), an optional "music" file name (or "auto" to pick one
+      from the music index) and an optional "duck" flag.
+    - engine (str): Caption engine, "ass" or "moviepy".
+
+    Returns:
+    - dict: Maps each variant name to the path of its video.
+    """
+    title_safe = sanitize_title(input_json['title'])
+    base_video = os.path.join(video_dir, title_safe, f"{title_safe}.mp4")
+    if not os.path.exists(base_video):
+        raise FileNotFoundError(f"Video file not found: {base_video}")
+    base = os.path.splitext(base_video)[0]
+
+    segments = None
+    outputs = {}
+    for variant in variants:
+        name = sanitize_title(variant["name"])
+        output_path = f"{base}_variant-{name}.mp4"
+        outputs[name] = output_path
+        if os.path.exists(output_path):
+            print(f"Output file already exists: {output_path}")
+            continue
+
+        source = base_video
+        style = variant.get("captions")
+        if style:
+            if style not in CAPTION_STYLES:
+                raise ValueError(f"Unknown caption style '{style}' in variant '{name}'")
+            source = f"{base}_captions-{style}.mp4"
+            if not os.path.exists(source):
+                if segments is None:
+                    segments = load_transcript_segments(os.path.join(trans_dir, title_safe, f"{title_safe}.json"))
+                ass_path = os.path.join(trans_dir, title_safe, f"{title_safe}_{style}.ass")
+                caption_video(base_video, segments, source, ass_path, engine=engine, style=CAPTION_STYLES[style])
 
-    print(f"Video with background music created successfully: {output_path}")
\ No newline at end of file
+        music = variant.get("music")
+        if music:
+            mix_music_with_ducking(source, music_dir, output_path, music_name=None if music == "auto" else music, ducking=variant.get("duck", False))
+        else:
+            with atomic_output(output_path) as temp_path:
+                shutil.copyfile(source, temp_path)
+        print(f"Variant '{name}' created successfully: {output_path}")
+    return outputs
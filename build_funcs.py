@@ -1,49 +1,114 @@
+import asyncio
 import os
-import json
+from functools import partial
 from tqdm import tqdm
-import requests
-from generation_funcs import generate_image_openai, generate_audio_openai, generate_image_leonardo ,generate_audio_elevenlabs, transcribe_audio
-from aux_funcs import sanitize_title, generate_video
+from concurrent.futures import ThreadPoolExecutor
+from pydub import AudioSegment
+from provider_funcs import get_provider
+from store_funcs import atomic_output, load_json, load_scene_times, save_json, save_transcript
+from aux_funcs import sanitize_title, image_title_safe, generate_video, render_scene_segment, concat_video_segments
 
-def save_images_from_json(generated_json, img_dir, service, leonardo_model):
+def save_images_from_json(generated_json, img_dir, service, leonardo_model, max_workers=None):
     """
     Function to save images based on the prompts in the JSON.
 
+    Scripts with an "image_title" use the images of that project instead of their own.
+    Images are requested concurrently through the provider's async interface, at most
+    its concurrency at a time; provider quotas and retries are handled by the shared
+    scheduler. If any scene still fails, an error listing the missing
+    scenes is raised so the video is never built with gaps.
+
     Args:
     - generated_json (dict): JSON dictionary representing the TikTok video script.
     - img_dir (str): Directory where the images should be saved.
+    - service (str): Name of the image provider to use (see provider_funcs).
+    - leonardo_model (str): Model ID for Leonardo image generation.
+    - max_workers (int): Maximum number of images generated at the same time (the provider's concurrency by default).
 
     Returns:
     - None
     """
-    title = generated_json['title']
-    title_safe = sanitize_title(title)
+    title_safe = image_title_safe(generated_json)
     title_img_dir = os.path.join(img_dir, title_safe)
     os.makedirs(title_img_dir, exist_ok=True)
     scenes = generated_json['scenes']
 
-    for scene in tqdm(scenes, desc="Generating images", unit="image"):
+    pending = {}
+    for scene in scenes:
         order = scene['order']
         image_path = os.path.join(title_img_dir, f"{order}.png")
         if not os.path.exists(image_path):
-            prompt_text = scene['image_prompt']
-            try:
-                if service == "openai":
-                    image_url = generate_image_openai(prompt_text)
-                elif service == "leonardo":
-                    image_url = generate_image_leonardo(prompt_text, leonardo_model)
-                response = requests.get(image_url)
-                with open(image_path, "wb") as file:
-                    file.write(response.content)
-            except Exception as e:
-                print(f"Error generating image for scene {order}: {str(e)}")
+            pending[order] = (scene, image_path)
         else:
             print(f"Image {order} already exists at '{image_path}'")
 
+    provider = get_provider("image", service)
+    calls = [
+        partial(provider.agenerate_image, scene['image_prompt'], image_path, project=title_safe, model=leonardo_model)
+        for scene, image_path in pending.values()
+    ]
+    with tqdm(total=len(calls), desc="Generating images", unit="image") as progress:
+        results = asyncio.run(gather_bounded(calls, max_workers or provider.capabilities["concurrency"], progress.update))
+
+    failed = []
+    for order, result in zip(pending, results):
+        if isinstance(result, Exception):
+            print(f"Error generating image for scene {order}: {str(result)}")
+            failed.append(order)
+
+    if failed:
+        raise RuntimeError(f"Images could not be generated for scenes: {failed}")
+
+async def gather_bounded(calls, limit, on_done=None):
+    """
+    Await the coroutines made by calls, running at most limit of them at a time.
+
+    The blocking work behind the providers' async methods runs in a thread pool of
+    the same size, so limit is also the number of requests in flight.
+
+    Args:
+    - calls (list): Functions taking no arguments that return a coroutine.
+    - limit (int): Maximum number of coroutines awaited at the same time.
+    - on_done (callable): Called with 1 as each coroutine finishes (e.g. a tqdm's update).
+
+    Returns:
+    - list: The result of each call, or the exception it raised, in order.
+    """
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=limit))
+    semaphore = asyncio.Semaphore(limit)
+
+    async def bounded(call):
+        async with semaphore:
+            try:
+                return await call()
+            finally:
+                if on_done is not None:
+                    on_done(1)
+
+    return await asyncio.gather(*(bounded(call) for call in calls), return_exceptions=True)
+
+def save_scene_image(scene, image_path, service, leonardo_model, project=None):
+    """
+    Function to generate the image of one scene and save it.
+
+    Args:
+    - scene (dict): Scene with its "image_prompt".
+    - image_path (str): Path where the image will be saved.
+    - service (str): Name of the image provider to use (see provider_funcs).
+    - leonardo_model (str): Model ID for Leonardo image generation.
+    - project (str): Sanitized title the cost is recorded under.
+
+    Returns:
+    - str: Path to the saved image.
+    """
+    return get_provider("image", service).generate_image(scene['image_prompt'], image_path, project=project, model=leonardo_model)
+
 def save_audio_from_json(json_data, audio_dir, service, elevenlabs_voice):
     """
     Function to save a single audio file based on the combined scripts in the JSON.
 
+    A "voice" or "language" set in the JSON (fan-out targets) takes precedence.
+
     Args:
     - json_data (dict): JSON dictionary representing the TikTok video script.
     - audio_dir (str): Directory where the audio should be saved.
@@ -56,14 +121,106 @@ def save_audio_from_json(json_data, audio_dir, service, elevenlabs_voice):
     title_audio_dir = os.path.join(audio_dir, title_safe)
     os.makedirs(title_audio_dir, exist_ok=True)
     combined_script = " ".join(scene['script'] for scene in json_data['scenes'])
+    voice, language = json_data.get("voice", elevenlabs_voice), json_data.get("language", "en")
     output_filename = os.path.join(title_audio_dir, f"{title_safe}.mp3")
     if not os.path.exists(output_filename):
-        if service == "openai":
-            generate_audio_openai(combined_script, output_filename)
-        elif service == "elevenlabs":
-            generate_audio_elevenlabs(combined_script, output_filename, elevenlabs_voice)
+        generate_audio(combined_script, output_filename, service, voice, project=title_safe, language=language)
+
+def save_audio_per_scene_from_json(json_data, audio_dir, service, elevenlabs_voice, max_workers=None):
+    """
+    Function to synthesize each scene's script concurrently (through the provider's async interface) and join the clips into a single audio file.
+
+    Scene start and end times are taken from the real duration of each clip, so they
+    match the narration exactly.
+
+    Args:
+    - json_data (dict): JSON dictionary representing the TikTok video script.
+    - audio_dir (str): Directory where the audio should be saved.
+    - service (str): Name of the speech provider to use (see provider_funcs).
+    - elevenlabs_voice (str): Voice ID for ElevenLabs audio generation.
+    - max_workers (int): Maximum number of scenes synthesized at the same time (the provider's concurrency by default).
+
+    Returns:
+    - dict: The JSON dictionary with "start" and "end" set on every scene.
+    """
+    title = json_data['title']
+    title_safe = sanitize_title(title)
+    title_audio_dir = os.path.join(audio_dir, title_safe)
+    scenes_audio_dir = os.path.join(title_audio_dir, "scenes")
+    os.makedirs(scenes_audio_dir, exist_ok=True)
+    scenes = json_data['scenes']
+    scene_paths = [os.path.join(scenes_audio_dir, f"{scene['order']}.mp3") for scene in scenes]
+    voice, language = json_data.get("voice", elevenlabs_voice), json_data.get("language", "en")
+
+    provider = get_provider("speech", service)
+    calls = [
+        partial(provider.asynthesize, scene['script'], path, voice=voice, language=language, project=title_safe)
+        for scene, path in zip(scenes, scene_paths)
+        if not os.path.exists(path)
+    ]
+    for result in asyncio.run(gather_bounded(calls, max_workers or provider.capabilities["concurrency"])):
+        if isinstance(result, Exception):
+            raise result
+
+    # Unir los clips sin huecos y tomar los tiempos de su duración real
+    narration = AudioSegment.empty()
+    for scene, path in zip(scenes, scene_paths):
+        clip = AudioSegment.from_file(path)
+        scene["start"] = len(narration) / 1000.0
+        narration += clip
+        scene["end"] = len(narration) / 1000.0
+
+    save_joined_narration(narration, scene_paths, os.path.join(title_audio_dir, f"{title_safe}.mp3"))
+    return json_data
+
+def save_joined_narration(narration, clip_paths, output_filename):
+    """
+    Save the narration joined from the scene clips, unless the file on disk was already joined from these same clips.
 
-def save_transcription_from_json(json_data, trans_dir, audio_dir):
+    A marker next to the clips records the size and modification time of every clip
+    and of the joined file, so a narration left by an earlier whole-script run, or
+    one joined from clips that were synthesized again, is rebuilt and always matches
+    the scene times taken from the clips.
+
+    Args:
+    - narration (AudioSegment): The clips joined in order.
+    - clip_paths (list): Paths to the scene clips, in order.
+    - output_filename (str): Path of the joined narration.
+
+    Returns:
+    - bool: Whether the narration was written.
+    """
+    marker_path = os.path.join(os.path.dirname(clip_paths[0]), "joined.json")
+
+    def signature(paths):
+        return [[os.path.basename(path), os.stat(path).st_size, os.stat(path).st_mtime_ns] for path in paths]
+
+    if os.path.exists(output_filename) and os.path.exists(marker_path):
+        if load_json(marker_path) == {"clips": signature(clip_paths), "output": signature([output_filename])}:
+            return False
+    with atomic_output(output_filename) as temp_path:
+        narration.export(temp_path, format="mp3")
+    save_json(marker_path, {"clips": signature(clip_paths), "output": signature([output_filename])})
+    return True
+
+def generate_audio(script_text, output_filename, service, voice, project=None, language="en"):
+    """
+    Function to generate an audio file with the selected speech provider.
+
+    Args:
+    - script_text (str): The script text to convert to audio.
+    - output_filename (str): The path where the audio file will be saved.
+    - service (str): Name of the speech provider to use (see provider_funcs).
+    - voice (str): ElevenLabs voice ID, or OpenAI voice name (other values use DEFAULT_OPENAI_VOICE).
+    - project (str): Sanitized title the cost is recorded under.
+    - language (str): ISO-639-1 code of the script.
+
+    Returns:
+    - None
+    """
+    get_provider("speech", service).synthesize(script_text, output_filename, voice=voice, language=language, project=project)
+
+def save_transcription_from_json(json_data, trans_dir, audio_dir, chunked=False, service="openai"):
     """
     Function to save transcription based on the audio generated from the scripts in the JSON.
 
@@ -71,6 +228,8 @@ def save_transcription_from_json(json_data, trans_dir, audio_dir):
     - json_data (dict): JSON dictionary representing the TikTok video script.
     - trans_dir (str): Directory where the transcription should be saved.
     - audio_dir (str): Directory where the audio files are stored.
+    - chunked (bool): Split the audio at silences and transcribe the chunks concurrently.
+    - service (str): Name of the transcription provider to use (see provider_funcs).
 
     Returns:
     - None
@@ -83,11 +242,16 @@ def save_transcription_from_json(json_data, trans_dir, audio_dir):
     audio_path = os.path.join(audio_dir, title_safe, audio_filename)
     transcript_path = os.path.join(title_trans_dir, f"{title_safe}.json")
     if not os.path.exists(transcript_path):
-        transcription_data = transcribe_audio(audio_path)
-        with open(transcript_path, 'w', encoding='utf-8') as file:
-            json.dump(transcription_data, file, ensure_ascii=False, indent=4)
+        transcription_data = get_provider("transcription", service).transcribe(
+            audio_path,
+            language=json_data.get("language", "en"),
+            script=" ".join(scene['script'] for scene in json_data['scenes']),
+            chunked=chunked,
+            project=title_safe,
+        )
+        save_transcript(transcript_path, transcription_data)
 
-def save_video_from_json(json_data, img_dir, audio_dir, video_dir):
+def save_video_from_json(json_data, img_dir, audio_dir, video_dir, renditions=None, json_dir=None):
     """
     Function to save a video based on the images and audio from the JSON data.
 
@@ -96,6 +260,8 @@ def save_video_from_json(json_data, img_dir, audio_dir, video_dir):
     - img_dir (str): Directory where the images are stored.
     - audio_dir (str): Directory where the audio files are stored.
     - video_dir (str): Directory where the video will be saved.
+    - renditions (list): If given, also encode these renditions from the same frames.
+    - json_dir (str): Directory where the JSON files are stored; if given, the scene times are read from the script's memory-mapped array.
 
     Returns:
     - str: Path to the saved video file.
@@ -107,7 +273,115 @@ def save_video_from_json(json_data, img_dir, audio_dir, video_dir):
     audio_filename = f"{title_safe}.mp3"
     audio_path = os.path.join(audio_dir, title_safe, audio_filename)
     video_output_path = os.path.join(video_output_dir, f"{title_safe}.mp4")
-    scene_durations = [(scene['start'], scene['end']) for scene in json_data['scenes']]
     if not os.path.exists(video_output_path):
-        generate_video(os.path.join(img_dir, title_safe), audio_path, video_output_path, scene_durations)
+        scene_times = load_scene_times(os.path.join(json_dir, title_safe, f"{title_safe}.json")) if json_dir else None
+        if scene_times is not None:
+            scene_durations = [(float(start), float(end)) for start, end in zip(scene_times["start"], scene_times["end"])]
+        else:
+            scene_durations = [(scene['start'], scene['end']) for scene in json_data['scenes']]
+        generate_video(os.path.join(img_dir, image_title_safe(json_data)), audio_path, video_output_path, scene_durations, renditions=renditions)
     return video_output_path
+
+def stream_video_from_json(json_data, img_dir, audio_dir, video_dir, image_service, audio_service, leonardo_model, elevenlabs_voice, max_workers=None, renditions=None, fps=24):
+    """
+    Function to generate, synthesize and render every scene as soon as its own inputs are ready.
+
+    Each scene's image and narration clip are requested concurrently. A scene's times
+    come from the clip durations, so it is rendered into a video-only segment as soon
+    as its image and the clips up to it have arrived, while later scenes are still
+    being generated. The segments are finally joined in order without re-encoding.
+    Scenes are joined with hard cuts instead of the crossfades of save_video_from_json.
+
+    Args:
+    - json_data (dict): JSON dictionary representing the TikTok video script.
+    - img_dir (str): Directory where the images should be saved.
+    - audio_dir (str): Directory where the audio should be saved.
+    - video_dir (str): Directory where the video will be saved.
+    - image_service (str): Name of the image provider to use (see provider_funcs).
+    - audio_service (str): Name of the speech provider to use (see provider_funcs).
+    - leonardo_model (str): Model ID for Leonardo image generation.
+    - elevenlabs_voice (str): Voice ID for ElevenLabs audio generation.
+    - max_workers (int): Maximum number of images, clips and segments produced at the same time (by default the higher concurrency of both providers).
+    - renditions (list): If given, also encode these renditions from the joined segments.
+    - fps (int): Frames per second of the video.
+
+    Returns:
+    - dict: The JSON dictionary with "start" and "end" set on every scene.
+    """
+    title = json_data['title']
+    title_safe = sanitize_title(title)
+    title_img_dir = os.path.join(img_dir, image_title_safe(json_data))
+    title_audio_dir = os.path.join(audio_dir, title_safe)
+    scenes_audio_dir = os.path.join(title_audio_dir, "scenes")
+    video_output_dir = os.path.join(video_dir, title_safe)
+    segments_dir = os.path.join(video_output_dir, "segments")
+    for directory in (title_img_dir, scenes_audio_dir, segments_dir):
+        os.makedirs(directory, exist_ok=True)
+    scenes = json_data['scenes']
+    voice, language = json_data.get("voice", elevenlabs_voice), json_data.get("language", "en")
+    audio_output_path = os.path.join(title_audio_dir, f"{title_safe}.mp3")
+    video_output_path = os.path.join(video_output_dir, f"{title_safe}.mp4")
+
+    max_workers = max_workers or max(
+        get_provider("image", image_service).capabilities["concurrency"],
+        get_provider("speech", audio_service).capabilities["concurrency"],
+    )
+
+    def ready(path, generate, *args, **kwargs):
+        if os.path.exists(path):
+            return path
+        generate(*args, **kwargs)
+        return path
+
+    def render_segment(image_future, index, start, end, segment_path):
+        image_path = image_future.result()
+        if not os.path.exists(segment_path):
+            render_scene_segment(image_path, index, start, end, segment_path, fps=fps)
+        return segment_path
+
+    with ThreadPoolExecutor(max_workers=max_workers) as generate_executor, ThreadPoolExecutor(max_workers=max_workers) as render_executor:
+        image_futures = []
+        audio_futures = []
+        for scene in scenes:
+            order = scene['order']
+            image_path = os.path.join(title_img_dir, f"{order}.png")
+            clip_path = os.path.join(scenes_audio_dir, f"{order}.mp3")
+            image_futures.append(generate_executor.submit(
+                ready, image_path, save_scene_image, scene, image_path, image_service, leonardo_model, project=title_safe
+            ))
+            audio_futures.append(generate_executor.submit(
+                ready, clip_path, generate_audio, scene['script'], clip_path, audio_service, voice, project=title_safe, language=language
+            ))
+
+        # Las escenas se lanzan a renderizar en orden en cuanto se conoce su inicio y su fin
+        narration = AudioSegment.empty()
+        segment_futures = []
+        for index, (scene, audio_future, image_future) in enumerate(zip(scenes, audio_futures, image_futures)):
+            clip = AudioSegment.from_file(audio_future.result())
+            scene["start"] = len(narration) / 1000.0
+            narration += clip
+            scene["end"] = len(narration) / 1000.0
+            segment_path = os.path.join(segments_dir, f"{scene['order']}_{round(scene['start'] * fps)}_{round(scene['end'] * fps)}.mp4")
+            segment_futures.append(render_executor.submit(
+                render_segment, image_future, index, scene["start"], scene["end"], segment_path
+            ))
+
+        clip_paths = [os.path.join(scenes_audio_dir, f"{scene['order']}.mp3") for scene in scenes]
+        narration_changed = save_joined_narration(narration, clip_paths, audio_output_path)
+
+        failed = []
+        segment_paths = []
+        for future, scene in zip(tqdm(segment_futures, desc="Rendering scenes", unit="scene"), scenes):
+            try:
+                segment_paths.append(future.result())
+            except Exception as e:
+                print(f"Error generating or rendering scene {scene['order']}: {str(e)}")
+                failed.append(scene['order'])
+
+    if failed:
+        raise RuntimeError(f"Scenes could not be generated or rendered: {failed}")
+    # Una narración reconstruida deja obsoleto el video unido con la anterior
+    if narration_changed or not os.path.exists(video_output_path):
+        poster_frame = round(scenes[-1]["end"] * fps) // 2
+        concat_video_segments(segment_paths, audio_output_path, video_output_path, renditions=renditions, poster_frame=poster_frame)
+    return json_data
@@ -0,0 +1,256 @@
+import os
+import sqlite3
+import threading
+import time
+
+STAGE_NAMES = {
+    1: "structure",
+    2: "script",
+    3: "images",
+    4: "audio",
+    5: "transcription",
+    6: "scene_times",
+    7: "video",
+    8: "subtitles",
+    9: "music",
+    10: "variants",
+}
+
+
+def artifact_size(path):
+    """
+    Size in bytes of a file, or of every file directly inside a directory.
+    """
+    if os.path.isdir(path):
+        with os.scandir(path) as entries:
+            return sum(entry.stat().st_size for entry in entries if entry.is_file())
+    return os.path.getsize(path)
+
+
+class ProjectCatalog:
+    """
+    SQLite index of every project, its stage status and its artifacts, so projects can be listed without walking the data folders.
+    """
+
+    def __init__(self, path=":memory:"):
+        self.lock = threading.Lock()
+        self.open(path)
+
+    def open(self, path):
+        """
+        Open (or create) the catalog database at path.
+        """
+        with self.lock:
+            self.path = path
+            self.connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+            self.connection.row_factory = sqlite3.Row
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS projects (
+                    key TEXT PRIMARY KEY,
+                    title TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    updated REAL NOT NULL,
+                    stage TEXT,
+                    status TEXT,
+                    video_path TEXT,
+                    size INTEGER,
+                    duration REAL,
+                    cost REAL
+                );
+                CREATE INDEX IF NOT EXISTS projects_updated ON projects (updated);
+                CREATE INDEX IF NOT EXISTS projects_status ON projects (status, updated);
+                CREATE TABLE IF NOT EXISTS stages (
+                    key TEXT NOT NULL,
+                    step INTEGER NOT NULL,
+                    name TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    seconds REAL,
+                    updated REAL NOT NULL,
+                    PRIMARY KEY (key, step)
+                );
+                CREATE TABLE IF NOT EXISTS artifacts (
+                    key TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    size INTEGER,
+                    updated REAL NOT NULL,
+                    PRIMARY KEY (key, kind)
+                );
+            """)
+            self.connection.commit()
+
+    def register(self, title, key):
+        """
+        Add a project to the catalog, or refresh its title if it is already there.
+
+        Args:
+        - title (str): Title of the project.
+        - key (str): Sanitized title, used as the project key.
+
+        Returns:
+        - str: The project key.
+        """
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                "INSERT INTO projects (key, title, created, updated) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET title = excluded.title, updated = excluded.updated",
+                (key, title, now, now),
+            )
+            self.connection.commit()
+        return key
+
+    def record_stage(self, key, step, status, seconds=None):
+        """
+        Record the outcome of a pipeline step for a project.
+
+        Args:
+        - key (str): Project key.
+        - step (int): Step number, a key of STAGE_NAMES.
+        - status (str): "done" or "failed".
+        - seconds (float): Time the step took.
+
+        Returns:
+        - None
+        """
+        now = time.time()
+        name = STAGE_NAMES[step]
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO stages (key, step, name, status, seconds, updated) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, step, name, status, seconds, now),
+            )
+            self.connection.execute(
+                "UPDATE projects SET stage = ?, status = ?, updated = ? WHERE key = ?", (name, status, now, key)
+            )
+            self.connection.commit()
+
+    def record_artifact(self, key, kind, path):
+        """
+        Record a file or folder produced for a project; paths that do not exist are ignored.
+
+        Artifacts whose kind starts with "video" (e.g. "video", "video_sub", "video_music")
+        become the project's playable video, so the last one recorded wins.
+
+        Args:
+        - key (str): Project key.
+        - kind (str): Artifact kind, unique per project (e.g. "audio", "video_sub:720p").
+        - path (str): Path to the artifact.
+
+        Returns:
+        - None
+        """
+        if not path or not os.path.exists(path):
+            return
+        size = artifact_size(path)
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO artifacts (key, kind, path, size, updated) VALUES (?, ?, ?, ?, ?)",
+                (key, kind, path, size, now),
+            )
+            if kind.startswith("video") and ":" not in kind:
+                self.connection.execute(
+                    "UPDATE projects SET video_path = ?, size = ?, updated = ? WHERE key = ?", (path, size, now, key)
+                )
+            self.connection.commit()
+
+    def update_project(self, key, **fields):
+        """
+        Set project fields such as "duration" or "cost".
+        """
+        if not fields:
+            return
+        unknown = set(fields) - {"duration", "cost"}
+        if unknown:
+            raise ValueError(f"Cannot update project fields: {sorted(unknown)}")
+        assignments = ", ".join(f"{field} = ?" for field in fields)
+        with self.lock:
+            self.connection.execute(
+                f"UPDATE projects SET {assignments}, updated = ? WHERE key = ?", (*fields.values(), time.time(), key)
+            )
+            self.connection.commit()
+
+    def list_projects(self, search=None, status=None, limit=50, offset=0):
+        """
+        List projects, most recently updated first.
+
+        Args:
+        - search (str): Only projects whose title contains this text.
+        - status (str): Only projects whose last stage has this status.
+        - limit (int): Maximum number of projects returned.
+        - offset (int): Number of projects skipped, for paging.
+
+        Returns:
+        - list: One dict per project with the columns of the projects table.
+        """
+        query, params = self._filter(search, status)
+        with self.lock:
+            rows = self.connection.execute(
+                f"SELECT * FROM projects{query} ORDER BY updated DESC LIMIT ? OFFSET ?", (*params, limit, offset)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def count_projects(self, search=None, status=None):
+        """
+        Number of projects matching the same filters as list_projects.
+        """
+        query, params = self._filter(search, status)
+        with self.lock:
+            return self.connection.execute(f"SELECT COUNT(*) FROM projects{query}", params).fetchone()[0]
+
+    def _filter(self, search, status):
+        conditions, params = [], []
+        if search:
+            conditions.append("title LIKE ?")
+            params.append(f"%{search}%")
+        if status:
+            conditions.append("status = ?")
+            params.append(status)
+        return (" WHERE " + " AND ".join(conditions) if conditions else ""), params
+
+    def get_project(self, key):
+        """
+        Get a project with its stages and artifacts.
+
+        Args:
+        - key (str): Project key.
+
+        Returns:
+        - dict: Project columns plus "stages" and "artifacts" lists, or None if it is not in the catalog.
+        """
+        with self.lock:
+            project = self.connection.execute("SELECT * FROM projects WHERE key = ?", (key,)).fetchone()
+            if project is None:
+                return None
+            stages = self.connection.execute("SELECT * FROM stages WHERE key = ? ORDER BY step", (key,)).fetchall()
+            artifacts = self.connection.execute("SELECT * FROM artifacts WHERE key = ? ORDER BY kind", (key,)).fetchall()
+        project = dict(project)
+        project["stages"] = [dict(row) for row in stages]
+        project["artifacts"] = [dict(row) for row in artifacts]
+        return project
+
+
+catalog = ProjectCatalog()
+
+
+def configure_catalog(path):
+    """
+    Point the shared catalog at a database file.
+
+    Args:
+    - path (str): Path to the SQLite catalog file.
+
+    Returns:
+    - ProjectCatalog: The shared catalog.
+    """
+    if catalog.path != path:
+        catalog.open(path)
+    return catalog
+
+
+def catalog_path(base_path):
+    """
+    Path of the catalog database for a base path.
+    """
+    return os.path.join(base_path, "data", "catalog.sqlite")
@@ -2,11 +2,17 @@ import json
 from openai import OpenAI
 from pathlib import Path
 import os
-from aux_funcs import sanitize_title
+from aux_funcs import sanitize_title, split_audio_on_silence, merge_chunk_transcriptions
 import requests
 import time
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from elevenlabs.client import ElevenLabs
 from elevenlabs import VoiceSettings
+from scheduler_funcs import scheduler, raise_for_provider_status, ProviderError
+from ledger_funcs import ledger, record_cost, LEONARDO_CREDITS_PER_IMAGE
+from provider_funcs import get_provider
+from store_funcs import atomic_write, load_json, save_script
 
 # Read the OpenAI API key from a file
 openai_key_path = 'api_keys/openai_key.txt'
@@ -30,20 +36,67 @@ with open(elevenlabs_key_path, 'r') as file:
 
 authorization = "Bearer %s" % leonardo_key
 client_el = ElevenLabs(api_key=api_key_el)
-client = OpenAI(api_key=openai_key)
+# Los reintentos los gestiona el planificador compartido
+client = OpenAI(api_key=openai_key, max_retries=0)
 
-def generate_image_leonardo(prompt,leonardo_model):
-    # Función para comprobar los créditos restantes
+OPENAI_VOICES = ("alloy", "echo", "fable", "onyx", "nova", "shimmer")
+DEFAULT_OPENAI_VOICE = "onyx"
+
+def get_leonardo_credits():
+    """
+    Function to get the remaining Leonardo API credits.
+
+    Returns:
+    - int: Remaining API subscription tokens.
+    """
     def check_credits():
         headers = {
             "accept": "application/json",
             "authorization": authorization
         }
-        response = requests.get("https://cloud.leonardo.ai/api/rest/v1/me", headers=headers)
+        response = raise_for_provider_status(requests.get("https://cloud.leonardo.ai/api/rest/v1/me", headers=headers))
         data = json.loads(response.text)
-        credits_left = data["user_details"][0]["apiSubscriptionTokens"]
-        return credits_left
+        return data["user_details"][0]["apiSubscriptionTokens"]
+
+    return scheduler.call("leonardo", check_credits)
+
+def get_elevenlabs_characters():
+    """
+    Function to get the remaining ElevenLabs characters.
+
+    Returns:
+    - int: Remaining characters, or None if they could not be retrieved.
+    """
+    def check_characters():
+        headers = {
+            'xi-api-key': api_key_el
+        }
+        response = raise_for_provider_status(requests.get('https://api.elevenlabs.io/v1/user/subscription', headers=headers))
+        data = response.json()
+        return data['character_limit'] - data['character_count']
+
+    try:
+        return scheduler.call("elevenlabs", check_characters)
+    except ProviderError as e:
+        print(f"Failed to retrieve ElevenLabs characters: {e}")
+        return None
+
+def reconcile_provider_balances(force=False):
+    """
+    Function to compare the cost ledger with the provider balances, at most once per reconcile interval.
+
+    Args:
+    - force (bool): Query the balances even if the interval has not elapsed.
+
+    Returns:
+    - None
+    """
+    if leonardo_key:
+        ledger.reconcile("leonardo", get_leonardo_credits, "credits", force=force)
+    if api_key_el:
+        ledger.reconcile("elevenlabs", get_elevenlabs_characters, "characters", force=force)
 
+def generate_image_leonardo(prompt, leonardo_model, project=None):
     # Función para generar la imagen
     def generate_image_id(prompt, leonardo_model):
         payload = {
@@ -65,7 +118,7 @@ def generate_image_leonardo(prompt,leonardo_model):
             "content-type": "application/json",
             "authorization": authorization
         }
-        response = requests.post("https://cloud.leonardo.ai/api/rest/v1/generations", json=payload, headers=headers)
+        response = raise_for_provider_status(requests.post("https://cloud.leonardo.ai/api/rest/v1/generations", json=payload, headers=headers))
         data = json.loads(response.text)
         generation_id = data["sdGenerationJob"]["generationId"]
         return generation_id
@@ -76,164 +129,198 @@ def generate_image_leonardo(prompt,leonardo_model):
             "accept": "application/json",
             "authorization": authorization
         }
-        time.sleep(30)  # Esperar 30 segundos para que la imagen se genere
-        response = requests.get(f"https://cloud.leonardo.ai/api/rest/v1/generations/{generation_id}", headers=headers)
+        response = raise_for_provider_status(requests.get(f"https://cloud.leonardo.ai/api/rest/v1/generations/{generation_id}", headers=headers))
         data = json.loads(response.text)
-        image_url = data["generations_by_pk"]["generated_images"][0]["url"]
+        generated_images = data["generations_by_pk"]["generated_images"]
+        if not generated_images:
+            # La generación sigue en curso: se reintenta más tarde
+            raise ProviderError(f"Generation {generation_id} is not ready yet", status_code=425, retry_after=10)
+        image_url = generated_images[0]["url"]
         return image_url
 
     # Ejecutar los pasos en orden
-    initial_credits = check_credits()
-    print(f"Créditos API restantes inicialmente: {initial_credits}")
-    
-    generation_id = generate_image_id(prompt, leonardo_model)
+    generation_id = scheduler.call("leonardo", generate_image_id, prompt, leonardo_model)
     print(f"ID de la generación: {generation_id}")
 
-    image_url = get_image_url(generation_id)
+    time.sleep(30)  # Esperar 30 segundos para que la imagen se genere
+    image_url = scheduler.call("leonardo", get_image_url, generation_id)
     print(f"URL de la imagen generada: {image_url}")
 
-    final_credits = check_credits()
-    print(f"Créditos API restantes después de la generación: {final_credits}")
-
-    generation_cost = initial_credits - final_credits
-    print(f"Costo de generar la imagen: {generation_cost}")
+    generation_cost = record_cost("leonardo", "image", LEONARDO_CREDITS_PER_IMAGE, project)
+    print(f"Costo estimado de generar la imagen: ${generation_cost:.4f}")
 
     return image_url
 
-def generate_image_openai(prompt_text):
+def generate_image_openai(prompt_text, project=None):
     """
     Function to generate an image URL based on a given prompt.
 
     Args:
     - prompt_text (str): The text prompt for the image.
+    - project (str): Sanitized title the cost is recorded under.
 
     Returns:
     - str: URL of the generated image.
     """
-    response = client.images.generate(
+    response = scheduler.call(
+        "openai",
+        client.images.generate,
         model="dall-e-3",
         prompt=prompt_text,
         n=1,
         quality="standard",
         size='1024x1024'
     )
+    record_cost("openai", "dall-e-3", 1, project)
     return response.data[0].url
 
-def generate_audio_elevenlabs(script_text: str, output_filepath: str, elevenlabs_voice):
+def generate_audio_elevenlabs(script_text: str, output_filepath: str, elevenlabs_voice, project=None, language="en"):
     """
     Function to generate an audio file from a given script text.
 
     Args:
     - script_text (str): The script text to convert to audio.
     - output_filepath (str): The path where the audio file will be saved.
+    - project (str): Sanitized title the cost is recorded under.
+    - language (str): ISO-639-1 code of the script; other languages than English use the multilingual model.
 
     Returns:
     - str: The path of the saved audio file.
     """
-
-    # Function to check remaining characters (credits)
-    def check_credits():
-        headers = {
-            'xi-api-key': api_key_el
-        }
-        response = requests.get('https://api.elevenlabs.io/v1/user/subscription', headers=headers)
-        if response.status_code == 200:
-            data = response.json()
-            remaining_characters = data['character_limit'] - data['character_count']
-            return remaining_characters
-        else:
-            print("Failed to retrieve data")
-            return None
-
-    # Calculate the cost in dollars for the given number of characters
-    def calculate_cost(characters_used):
-        monthly_characters = 30000
-        monthly_cost = 50 / 12  # Annual cost of $50 spread over 12 months
-        cost_per_character = monthly_cost / monthly_characters
-        return characters_used * cost_per_character
-
-    # Check initial credits
-    initial_credits = check_credits()
-    print(f"Initial remaining characters: {initial_credits}")
-
-    # Generate the audio
-    response = client_el.text_to_speech.convert(
-        voice_id=elevenlabs_voice,  # choose the voice id 'yl2ZDV1MzN4HbQJbMihG'
-        optimize_streaming_latency="0",
-        output_format="mp3_22050_32",
-        text=script_text,
-        model_id="eleven_turbo_v2",  # use the turbo model for low latency, for other languages
-        voice_settings=VoiceSettings(
-            stability=0.0,
-            similarity_boost=1.0,
-            style=0.0,
-            use_speaker_boost=False,
+    # Generate the audio and write it to a file (the request runs while the stream is consumed)
+    def synthesize():
+        response = client_el.text_to_speech.convert(
+            voice_id=elevenlabs_voice,  # choose the voice id 'yl2ZDV1MzN4HbQJbMihG'
+            optimize_streaming_latency="0",
+            output_format="mp3_22050_32",
+            text=script_text,
+            model_id="eleven_turbo_v2" if language == "en" else "eleven_multilingual_v2",  # turbo for English, multilingual for other languages
+            voice_settings=VoiceSettings(
+                stability=0.0,
+                similarity_boost=1.0,
+                style=0.0,
+                use_speaker_boost=False,
+            )
         )
-    )
-
+        with atomic_write(output_filepath, "wb") as f:
+            for chunk in response:
+                if chunk:
+                    f.write(chunk)
 
-    # Write the audio to a file
-    with open(output_filepath, "wb") as f:
-        for chunk in response:
-            if chunk:
-                f.write(chunk)
+    scheduler.call("elevenlabs", synthesize, units=len(script_text))
 
     print(f"Output file saved at: {output_filepath}")
 
-    # Check final credits
-    final_credits = check_credits()
-    print(f"Remaining characters after generation: {final_credits}")
+    # Record the estimated cost of the characters used
+    cost_in_dollars = record_cost("elevenlabs", "tts", len(script_text), project)
+    print(f"Characters used for generation: {len(script_text)}")
+    print(f"Estimated cost to generate the audio: ${cost_in_dollars:.4f}")
 
-    # Calculate and print the credits used
-    if initial_credits is not None and final_credits is not None:
-        characters_used = initial_credits - final_credits
-        cost_in_dollars = calculate_cost(characters_used)
-        print(f"Characters used for generation: {characters_used}")
-        print(f"Cost to generate the audio: ${cost_in_dollars:.4f}")
-
-def generate_audio_openai(script_text, output_filename):
+def generate_audio_openai(script_text, output_filename, project=None, voice=DEFAULT_OPENAI_VOICE):
     """
     Function to generate an audio file from a given script text.
 
     Args:
     - script_text (str): The script text to convert to audio.
     - output_filename (str): The filename where the audio will be saved.
+    - project (str): Sanitized title the cost is recorded under.
+    - voice (str): OpenAI voice, one of OPENAI_VOICES.
 
     Returns:
     - None
     """
-    response = client.audio.speech.create(
+    response = scheduler.call(
+        "openai",
+        client.audio.speech.create,
+        units=len(script_text),
         model="tts-1",
-        voice="onyx",
+        voice=voice,
         input=script_text,
     )
-    with open(output_filename, "wb") as file:
+    with atomic_write(output_filename, "wb") as file:
         file.write(response.content)
+    record_cost("openai", "tts-1", len(script_text), project)
 
-def transcribe_audio(audio_path):
+def transcribe_audio(audio_path, project=None, language="en"):
     """
     Function to transcribe audio and return the transcription data.
 
     Args:
     - audio_path (str): Path to the audio file to transcribe.
+    - project (str): Sanitized title the cost is recorded under.
+    - language (str): ISO-639-1 code of the spoken language.
 
     Returns:
     - dict: Transcription data including text and segments.
     """
-    with open(audio_path, "rb") as audio_file:
-        transcript = client.audio.transcriptions.create(
-            file=audio_file,
-            model="whisper-1",
-            response_format="verbose_json",
-            timestamp_granularities=["word"],
-            language='en'
-        )
+    # El archivo se abre en cada intento para que un reintento suba el audio completo
+    def transcribe():
+        with open(audio_path, "rb") as audio_file:
+            return client.audio.transcriptions.create(
+                file=audio_file,
+                model="whisper-1",
+                response_format="verbose_json",
+                timestamp_granularities=["word"],
+                language=language
+            )
+
+    transcript = scheduler.call("openai", transcribe)
+    record_cost("openai", "whisper-1", float(getattr(transcript, "duration", 0) or 0), project)
     return {
         "text": transcript.text,
         "segments": transcript.words
     }
 
-def generate_json(input_json, prompt_path, JSON_dir):
+def transcribe_audio_chunked(audio_path, max_chunk_seconds=60, max_workers=4, project=None, language="en"):
+    """
+    Function to transcribe audio in silence-aligned chunks transcribed concurrently.
+
+    Args:
+    - audio_path (str): Path to the audio file to transcribe.
+    - max_chunk_seconds (float): Maximum length of each chunk in seconds.
+    - max_workers (int): Maximum number of chunks transcribed at the same time.
+    - project (str): Sanitized title the cost is recorded under.
+    - language (str): ISO-639-1 code of the spoken language.
+
+    Returns:
+    - dict: Transcription data including text and segments.
+    """
+    with tempfile.TemporaryDirectory() as chunk_dir:
+        chunks = split_audio_on_silence(audio_path, chunk_dir, max_chunk_seconds)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            transcriptions = list(executor.map(lambda chunk: transcribe_audio(chunk["path"], project, language), chunks))
+    return merge_chunk_transcriptions(chunks, transcriptions)
+
+def generate_script_openai(formatted_prompt, project=None):
+    """
+    Function to generate a TikTok video script JSON from a formatted prompt with gpt-4.
+
+    Args:
+    - formatted_prompt (str): Prompt template filled with the title, topic and description.
+    - project (str): Sanitized title the cost is recorded under.
+
+    Returns:
+    - dict: JSON dictionary representing the TikTok video script.
+    """
+    response = scheduler.call(
+        "openai",
+        client.chat.completions.create,
+        units=len(formatted_prompt) // 4 + 1000,
+        model="gpt-4",
+        messages=[
+            {"role": "system", "content": "You are a helpful assistant designed to output JSON."},
+            {"role": "user", "content": formatted_prompt}
+        ],
+        max_tokens=1000,
+        temperature=0.8
+    )
+    record_cost("openai", "gpt-4:input", response.usage.prompt_tokens, project)
+    record_cost("openai", "gpt-4:output", response.usage.completion_tokens, project)
+
+    # Extract the JSON content from the response
+    return json.loads(response.choices[0].message.content.strip())
+
+def generate_json(input_json, prompt_path, JSON_dir, service="openai"):
     """
     Function to generate a JSON dictionary for a viral TikTok video script, and save it to a file.
 
@@ -241,6 +328,7 @@ def generate_json(input_json, prompt_path, JSON_dir):
     - input_json (dict): Input dictionary containing title, topic, and description.
     - prompt_path (str): Path to the file containing the prompt template.
     - JSON_dir (str): Directory where the JSON output should be saved.
+    - service (str): Name of the script provider to use (see provider_funcs).
 
     Returns:
     - dict: JSON dictionary representing the TikTok video script.
@@ -256,41 +344,124 @@ def generate_json(input_json, prompt_path, JSON_dir):
     # Check if the JSON already exists
     if os.path.exists(output_file):
         print(f"Loading existing JSON from {output_file}")
-        with open(output_file, 'r', encoding='utf-8') as file:
-            existing_json = json.load(file)
-        return existing_json
+        return load_json(output_file)
 
     # Create the directory if it does not exist
     os.makedirs(output_dir, exist_ok=True)
 
-    # Generate the prompt
-    with open(prompt_path, 'r', encoding='utf-8') as file:
-        prompt_template = file.read()
+    # Generate the prompt (template providers such as the offline one do not need it)
+    formatted_prompt = None
+    if prompt_path:
+        with open(prompt_path, 'r', encoding='utf-8') as file:
+            prompt_template = file.read()
 
+        formatted_prompt = prompt_template.format(
+            title=input_json["title"],
+            topic=input_json["topic"],
+            description=input_json["description"]
+        )
 
-    formatted_prompt = prompt_template.format(
-        title=input_json["title"],
-        topic=input_json["topic"],
-        description=input_json["description"]
-    )
+    generated_json = get_provider("script", service).generate_script(formatted_prompt, input_json, project=title_safe)
+
+    # Save the JSON content to a file
+    save_script(output_file, generated_json)
+
+    print(f"Created new JSON and saved to {output_file}")
+    return generated_json
 
-    # Call the OpenAI API to generate the JSON output
-    response = client.chat.completions.create(
+def translate_scripts(scripts, languages, source_language="en", project=None):
+    """
+    Function to translate scene scripts into several languages with a single chat completion.
+
+    Args:
+    - scripts (list): Scene scripts in playback order.
+    - languages (list): ISO-639-1 codes of the target languages.
+    - source_language (str): ISO-639-1 code of the scripts.
+    - project (str): Sanitized title the cost is recorded under.
+
+    Returns:
+    - dict: Maps each target language to its list of translated scripts, in the same order.
+    """
+    prompt = (
+        f"Translate these TikTok scene scripts from '{source_language}' into each of these languages: "
+        f"{', '.join(languages)}. Keep the dramatic tone and roughly the same length so each scene "
+        "keeps its pacing, and keep names and dates accurate. Return a JSON object that maps each "
+        "language code to the list of translated scripts, in the same order as the input.\n\n"
+        + json.dumps(scripts, ensure_ascii=False)
+    )
+    # Cada traducción ocupa aproximadamente lo mismo que el original, con margen
+    max_tokens = min(4000, (len(json.dumps(scripts, ensure_ascii=False)) // 2 + 100) * len(languages))
+    response = scheduler.call(
+        "openai",
+        client.chat.completions.create,
+        units=len(prompt) // 4 + max_tokens,
         model="gpt-4",
         messages=[
             {"role": "system", "content": "You are a helpful assistant designed to output JSON."},
-            {"role": "user", "content": formatted_prompt}
+            {"role": "user", "content": prompt}
         ],
-        max_tokens=1000,
-        temperature=0.8
+        max_tokens=max_tokens,
+        temperature=0.3
     )
+    record_cost("openai", "gpt-4:input", response.usage.prompt_tokens, project)
+    record_cost("openai", "gpt-4:output", response.usage.completion_tokens, project)
 
-    # Extract the JSON content from the response
-    generated_json = json.loads(response.choices[0].message.content.strip())
+    translations = json.loads(response.choices[0].message.content.strip())
+    for language in languages:
+        if len(translations.get(language, [])) != len(scripts):
+            raise ValueError(f"Translation into '{language}' does not have {len(scripts)} scripts")
+    return {language: translations[language] for language in languages}
 
-    # Save the JSON content to a file
-    with open(output_file, 'w', encoding='utf-8') as file:
-        json.dump(generated_json, file, ensure_ascii=False, indent=4)
-    
-    print(f"Created new JSON and saved to {output_file}")
-    return generated_json
+def generate_target_jsons(generated_json, targets, JSON_dir, source_language="en", service="openai"):
+    """
+    Function to create and save one script JSON per (language, provider, voice) target of a generated script.
+
+    Every target JSON keeps the scenes and image prompts of the source script and
+    points at its images through "image_title", so only the audio and the renders
+    depending on it are produced again. Scripts are translated into every language
+    still missing, as many languages per request as the script provider allows.
+
+    Args:
+    - generated_json (dict): JSON dictionary representing the source TikTok video script.
+    - targets (list): Targets as dicts with "language", "provider" and "voice".
+    - JSON_dir (str): Directory where the JSON outputs should be saved.
+    - source_language (str): ISO-639-1 code of the source script.
+    - service (str): Name of the script provider that translates (see provider_funcs).
+
+    Returns:
+    - list: The target JSON dictionaries, in the order of targets.
+    """
+    title = generated_json["title"]
+    target_jsons = [None] * len(targets)
+    missing = {}
+    for i, target in enumerate(targets):
+        target_title = f"{title} {target['language']} {target['voice']}"
+        target_file = os.path.join(JSON_dir, sanitize_title(target_title), f"{sanitize_title(target_title)}.json")
+        if os.path.exists(target_file):
+            print(f"Loading existing JSON from {target_file}")
+            target_jsons[i] = load_json(target_file)
+        else:
+            missing[i] = (target_title, target_file)
+
+    scripts = [scene["script"] for scene in generated_json["scenes"]]
+    languages = sorted({targets[i]["language"] for i in missing} - {source_language})
+    provider = get_provider("script", service)
+    batch = provider.capabilities["max_batch"]
+    translations = {}
+    for start in range(0, len(languages), batch):
+        translations.update(provider.translate_scripts(scripts, languages[start:start + batch], source_language, project=sanitize_title(title)))
+    translations[source_language] = scripts
+
+    for i, (target_title, target_file) in missing.items():
+        target = targets[i]
+        target_json = dict(generated_json, title=target_title, language=target["language"], voice=target["voice"])
+        target_json["image_title"] = generated_json.get("image_title", title)
+        target_json["scenes"] = [
+            {key: value for key, value in dict(scene, script=script).items() if key not in ("start", "end")}
+            for scene, script in zip(generated_json["scenes"], translations[target["language"]])
+        ]
+        os.makedirs(os.path.dirname(target_file), exist_ok=True)
+        save_script(target_file, target_json)
+        print(f"Created target JSON and saved to {target_file}")
+        target_jsons[i] = target_json
+    return target_jsons
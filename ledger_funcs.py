@@ -0,0 +1,197 @@
+import sqlite3
+import threading
+import time
+
+# Precios estimados por unidad en dólares; la conciliación con los saldos corrige la deriva
+PRICES = {
+    ("openai", "dall-e-3"): {"unit": "images", "price": 0.04},
+    ("openai", "tts-1"): {"unit": "characters", "price": 15.0 / 1_000_000},
+    ("openai", "whisper-1"): {"unit": "seconds", "price": 0.006 / 60},
+    ("openai", "gpt-4:input"): {"unit": "tokens", "price": 30.0 / 1_000_000},
+    ("openai", "gpt-4:output"): {"unit": "tokens", "price": 60.0 / 1_000_000},
+    ("leonardo", "image"): {"unit": "credits", "price": 9.0 / 3500},
+    ("elevenlabs", "tts"): {"unit": "characters", "price": (50 / 12) / 30000},
+}
+LEONARDO_CREDITS_PER_IMAGE = 16  # Alchemy a 1024x1024, una imagen
+RECONCILE_INTERVAL = 3600  # Segundos entre consultas de saldo a cada proveedor
+
+
+class CostLedger:
+    """
+    SQLite ledger of estimated provider costs, reconciled periodically against provider balances.
+    """
+
+    def __init__(self, path=":memory:"):
+        self.lock = threading.Lock()
+        self.batch = None
+        self.open(path)
+
+    def open(self, path):
+        """
+        Open (or create) the ledger database at path.
+        """
+        with self.lock:
+            self.path = path
+            self.connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS costs (
+                    id INTEGER PRIMARY KEY,
+                    created REAL NOT NULL,
+                    provider TEXT NOT NULL,
+                    operation TEXT NOT NULL,
+                    project TEXT,
+                    batch TEXT,
+                    units REAL NOT NULL,
+                    unit TEXT NOT NULL,
+                    cost REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS costs_project ON costs (project);
+                CREATE INDEX IF NOT EXISTS costs_batch ON costs (batch);
+                CREATE TABLE IF NOT EXISTS balances (
+                    id INTEGER PRIMARY KEY,
+                    created REAL NOT NULL,
+                    provider TEXT NOT NULL,
+                    balance REAL NOT NULL,
+                    unit TEXT NOT NULL
+                );
+            """)
+            self.connection.commit()
+
+    def record(self, provider, operation, units, project=None):
+        """
+        Record the estimated cost of a provider call.
+
+        Args:
+        - provider (str): Provider name.
+        - operation (str): Priced operation, a key of PRICES together with the provider.
+        - units (float): Units consumed, in the operation's unit.
+        - project (str): Sanitized title of the project the call belongs to.
+
+        Returns:
+        - float: Estimated cost in dollars.
+        """
+        price = PRICES[(provider, operation)]
+        cost = units * price["price"]
+        with self.lock:
+            self.connection.execute(
+                "INSERT INTO costs (created, provider, operation, project, batch, units, unit, cost) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (time.time(), provider, operation, project, self.batch, units, price["unit"], cost),
+            )
+            self.connection.commit()
+        return cost
+
+    def total(self, project=None, batch=None):
+        """
+        Total estimated cost, optionally filtered by project and/or batch.
+
+        Returns:
+        - float: Cost in dollars.
+        """
+        query = "SELECT COALESCE(SUM(cost), 0) FROM costs WHERE 1 = 1"
+        params = []
+        if project is not None:
+            query += " AND project = ?"
+            params.append(project)
+        if batch is not None:
+            query += " AND batch = ?"
+            params.append(batch)
+        with self.lock:
+            return self.connection.execute(query, params).fetchone()[0]
+
+    def totals_by(self, column):
+        """
+        Estimated cost grouped by "project", "batch" or "provider".
+
+        Returns:
+        - dict: Maps each value of the column to its cost in dollars.
+        """
+        if column not in ("project", "batch", "provider"):
+            raise ValueError(f"Cannot group costs by {column}")
+        with self.lock:
+            rows = self.connection.execute(f"SELECT {column}, SUM(cost) FROM costs GROUP BY {column}").fetchall()
+        return dict(rows)
+
+    def reconcile(self, provider, fetch_balance, unit, force=False, interval=RECONCILE_INTERVAL):
+        """
+        Snapshot a provider balance if the last one is older than interval and report the drift.
+
+        The drift compares how much the balance actually dropped since the previous
+        snapshot with the units the ledger estimated for that provider in between.
+
+        Args:
+        - provider (str): Provider name.
+        - fetch_balance (callable): Returns the provider's remaining balance in `unit`.
+        - unit (str): Unit of the balance, matching the unit used in PRICES.
+        - force (bool): Query the balance even if the interval has not elapsed.
+        - interval (float): Minimum seconds between balance queries.
+
+        Returns:
+        - float: Balance drop minus estimated units since the previous snapshot, or None.
+        """
+        with self.lock:
+            last = self.connection.execute(
+                "SELECT created, balance FROM balances WHERE provider = ? ORDER BY created DESC LIMIT 1", (provider,)
+            ).fetchone()
+        if last is not None and not force and time.time() - last[0] < interval:
+            return None
+
+        balance = fetch_balance()
+        if balance is None:
+            return None
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                "INSERT INTO balances (created, provider, balance, unit) VALUES (?, ?, ?, ?)", (now, provider, balance, unit)
+            )
+            self.connection.commit()
+            if last is None:
+                return None
+            estimated = self.connection.execute(
+                "SELECT COALESCE(SUM(units), 0) FROM costs WHERE provider = ? AND unit = ? AND created >= ? AND created < ?",
+                (provider, unit, last[0], now),
+            ).fetchone()[0]
+
+        drift = (last[1] - balance) - estimated
+        print(f"{provider} balance: {balance} {unit} (drift vs. ledger estimate: {drift:+.0f} {unit})")
+        return drift
+
+
+ledger = CostLedger()
+
+
+def configure_ledger(path, batch=None):
+    """
+    Point the shared ledger at a database file and set the batch new costs are recorded under.
+
+    Args:
+    - path (str): Path to the SQLite ledger file.
+    - batch (str): Identifier of the current batch (e.g. one pipeline run).
+
+    Returns:
+    - CostLedger: The shared ledger.
+    """
+    if ledger.path != path:
+        ledger.open(path)
+    ledger.batch = batch
+    return ledger
+
+
+def record_cost(provider, operation, units, project=None):
+    """
+    Record the estimated cost of a provider call in the shared ledger.
+    """
+    return ledger.record(provider, operation, units, project)
+
+
+def project_cost(project):
+    """
+    Total estimated cost of a project (sanitized title) in dollars.
+    """
+    return ledger.total(project=project)
+
+
+def batch_cost(batch):
+    """
+    Total estimated cost of a batch in dollars.
+    """
+    return ledger.total(batch=batch)
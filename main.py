@@ -5,19 +5,74 @@ import time
 import traceback
 
 from aux_funcs import (
+    RENDITIONS,
     add_background_music_to_video,
+    add_music_to_renditions,
     add_subtitles_to_video,
     create_project_structure,
+    image_title_safe,
+    rendition_paths,
+    render_style_variants,
     sanitize_title,
+    save_scene_times,
     update_and_save_scene_times,
+    update_scene_times_from_transcript,
 )
 from build_funcs import (
     save_audio_from_json,
+    save_audio_per_scene_from_json,
     save_images_from_json,
     save_transcription_from_json,
     save_video_from_json,
+    stream_video_from_json,
 )
-from generation_funcs import generate_json
+from catalog_funcs import catalog, catalog_path, configure_catalog
+from generation_funcs import generate_json, generate_target_jsons, reconcile_provider_balances
+from ledger_funcs import batch_cost, configure_ledger, project_cost
+from profile_funcs import configure_profiling
+from provider_funcs import OFFLINE_PROVIDERS, get_provider, provider_names
+from queue_funcs import JOB_KINDS, Heartbeat, JobQueue, default_worker_id
+from store_funcs import scene_times_path, word_times_path
+
+
+def update_catalog(project, step, status, step_start_time, artifacts=(), **fields):
+    """
+    Record a step's outcome and artifacts in the project catalog without interrupting the pipeline.
+
+    Args:
+    - project (str): Project key (sanitized title).
+    - step (int): Step number.
+    - status (str): "done" or "failed".
+    - step_start_time (float): Time the step started.
+    - artifacts (list): (kind, path) pairs produced by the step.
+    - fields: Project fields to set, such as duration or cost.
+
+    Returns:
+    - None
+    """
+    try:
+        catalog.record_stage(project, step, status, time.time() - step_start_time)
+        for kind, path in artifacts:
+            catalog.record_artifact(project, kind, path)
+        catalog.update_project(project, **fields)
+    except Exception as e:
+        print(f"Error updating the project catalog: {e}")
+
+
+def new_batch_id():
+    """
+    Batch ID for a run that was not given one: the current local time.
+    """
+    return time.strftime("%Y%m%d-%H%M%S")
+
+
+def rendition_artifacts(kind, video_path):
+    """
+    Catalog (kind, path) pairs of a video and its renditions, poster and preview.
+    """
+    return [(kind, video_path)] + [
+        (f"{kind}:{name}", path) for name, path in rendition_paths(video_path, RENDITIONS).items()
+    ]
 
 
 def main(
@@ -29,6 +84,21 @@ def main(
     generate_audio_with,
     add_music,
     add_subtitles,
+    generate_scripts_with="openai",
+    transcribe_with="openai",
+    chunked_transcription=False,
+    per_scene_audio=False,
+    stream_scenes=False,
+    align_scenes=False,
+    duck_music=False,
+    subtitle_engine="moviepy",
+    soft_subtitles=False,
+    renditions=False,
+    profile_renders=False,
+    variants=None,
+    batch_id=None,
+    input_json=None,
+    stages=("generate", "render"),
 ):
     """
     Main function to execute the full pipeline for creating a TikTok video script, generating images, audio, transcription, and compiling them into a video with subtitles.
@@ -38,21 +108,39 @@ def main(
     - prompt_path (str): Path to the prompt template file.
     - leonardo_model (str): Model ID for Leonardo image generation.
     - elevenlabs_voice (str): Voice ID for ElevenLabs audio generation.
-    - generate_images_with (str): Service to use for generating images ("openai" or "leonardo").
-    - generate_audio_with (str): Service to use for generating audio ("openai" or "elevenlabs").
+    - generate_images_with (str): Image provider to use (e.g. "openai", "leonardo" or the offline "procedural").
+    - generate_audio_with (str): Speech provider to use (e.g. "openai", "elevenlabs" or the offline "tone").
     - add_music (bool): Flag to indicate if music should be added.
     - add_subtitles (bool): Flag to indicate if subtitles should be added.
+    - generate_scripts_with (str): Script provider to use ("openai" or the offline "template").
+    - transcribe_with (str): Transcription provider to use ("openai" or the offline "synthetic").
+    - chunked_transcription (bool): Flag to transcribe the audio in concurrent silence-aligned chunks.
+    - per_scene_audio (bool): Flag to synthesize each scene separately and take scene times from the clips.
+    - stream_scenes (bool): Flag to render each scene as soon as its image and audio are ready (steps 3, 4 and 7 in one pass).
+    - align_scenes (bool): Flag to take scene times from the word-level transcription.
+    - duck_music (bool): Flag to lower the music under the narration and remux the audio.
+    - subtitle_engine (str): Caption engine to use ("moviepy" or "ass").
+    - soft_subtitles (bool): Flag to add a subtitle track instead of burning captions in (ass engine only).
+    - renditions (bool): Flag to encode every rendition in RENDITIONS, a poster and a preview from the final render.
+    - profile_renders (bool): Flag to write a per-frame profile and a flame graph dump next to every rendered video.
+    - variants (list): Style variants (caption style and music) to derive from the caption-free render, as in render_style_variants.
+    - batch_id (str): Batch the provider costs are recorded under (defaults to a new batch; fan-out runs and queued jobs get one shared by all their runs).
+    - input_json (dict): Input details; read from base_path/input.json when not given.
+    - stages (tuple): Stages to run: "generate" (steps 3-6) and/or "render" (steps 7-10).
 
     Returns:
-    - None
+    - list: Numbers of the steps that failed.
     """
     print("Starting the project pipeline...")
     start_time = time.time()
+    failed_steps = []
 
     # Load input JSON
-    input_json_path = os.path.join(base_path, "input.json")
-    with open(input_json_path, "r", encoding="utf-8") as file:
-        input_json = json.load(file)
+    if input_json is None:
+        input_json_path = os.path.join(base_path, "input.json")
+        with open(input_json_path, "r", encoding="utf-8") as file:
+            input_json = json.load(file)
+    project = sanitize_title(input_json["title"])
 
     # Step 1: Create project structure
     try:
@@ -62,95 +150,221 @@ def main(
             create_project_structure(base_path)
         )
         music_dir = os.path.join(data_dir, "music")
+        batch_id = batch_id or new_batch_id()
+        configure_ledger(os.path.join(data_dir, "ledger.sqlite"), batch=batch_id)
+        configure_catalog(catalog_path(base_path)).register(input_json["title"], project)
+        configure_profiling(profile_renders)
         step_end_time = time.time()
         print(f"Project directories created under base path: {base_path}")
         print(f"Step 1 completed in {step_end_time - step_start_time:.2f} seconds.")
+        update_catalog(project, 1, "done", step_start_time)
     except Exception as e:
         print(f"Error in Step 1: {e}")
         traceback.print_exc()
+        failed_steps.append(1)
 
     # Step 2: Generate JSON from input
     try:
         print("Step 2: Generating JSON from input...")
         step_start_time = time.time()
-        generated_json = generate_json(input_json, prompt_path, JSON_dir)
+        generated_json = generate_json(input_json, prompt_path, JSON_dir, service=generate_scripts_with)
         step_end_time = time.time()
         print("JSON generated and saved.")
         print(f"Step 2 completed in {step_end_time - step_start_time:.2f} seconds.")
+        update_catalog(project, 2, "done", step_start_time, [("script", os.path.join(JSON_dir, project, f"{project}.json"))])
     except Exception as e:
         print(f"Error in Step 2: {e}")
         traceback.print_exc()
+        failed_steps.append(2)
+        update_catalog(project, 2, "failed", step_start_time)
+
+    # Steps 3, 4 and 7: Generate and render every scene as soon as its inputs arrive.
+    # Only when this run does both stages; with the stages split across workers the
+    # generate job writes the images and per-scene clips and the render job streams them
+    streaming_pass = stream_scenes and "generate" in stages and "render" in stages
+    if streaming_pass:
+        try:
+            print("Steps 3-4: Generating images and audio and rendering scenes as they arrive...")
+            step_start_time = time.time()
+            generated_json = stream_video_from_json(
+                generated_json,
+                img_dir,
+                audio_dir,
+                video_dir,
+                generate_images_with,
+                generate_audio_with,
+                leonardo_model,
+                elevenlabs_voice,
+                renditions=RENDITIONS if renditions and not add_subtitles else None,
+            )
+            step_end_time = time.time()
+            print(f"Steps 3-4 completed in {step_end_time - step_start_time:.2f} seconds.")
+            update_catalog(project, 3, "done", step_start_time, [("images", os.path.join(img_dir, image_title_safe(generated_json)))])
+            update_catalog(project, 4, "done", step_start_time, [("audio", os.path.join(audio_dir, project, f"{project}.mp3"))])
+        except Exception as e:
+            print(f"Error in Steps 3-4: {e}")
+            traceback.print_exc()
+            failed_steps.extend([3, 4])
+            update_catalog(project, 3, "failed", step_start_time)
+            update_catalog(project, 4, "failed", step_start_time)
 
     # Step 3: Save images from JSON
-    try:
-        print("Step 3: Generating and saving images...")
-        step_start_time = time.time()
-        save_images_from_json(
-            generated_json, img_dir, generate_images_with, leonardo_model
-        )
-        step_end_time = time.time()
-        print(f"Step 3 completed in {step_end_time - step_start_time:.2f} seconds.")
-    except Exception as e:
-        print(f"Error in Step 3: {e}")
-        traceback.print_exc()
+    if "generate" in stages and not streaming_pass:
+        try:
+            print("Step 3: Generating and saving images...")
+            step_start_time = time.time()
+            save_images_from_json(
+                generated_json, img_dir, generate_images_with, leonardo_model
+            )
+            step_end_time = time.time()
+            print(f"Step 3 completed in {step_end_time - step_start_time:.2f} seconds.")
+            update_catalog(project, 3, "done", step_start_time, [("images", os.path.join(img_dir, image_title_safe(generated_json)))])
+        except Exception as e:
+            print(f"Error in Step 3: {e}")
+            traceback.print_exc()
+            failed_steps.append(3)
+            update_catalog(project, 3, "failed", step_start_time)
 
     # Step 4: Save audio from JSON
-    try:
-        print("Step 4: Generating and saving audio...")
-        step_start_time = time.time()
-        save_audio_from_json(
-            generated_json, audio_dir, generate_audio_with, elevenlabs_voice
-        )
-        step_end_time = time.time()
-        print(f"Step 4 completed in {step_end_time - step_start_time:.2f} seconds.")
-    except Exception as e:
-        print(f"Error in Step 4: {e}")
-        traceback.print_exc()
+    if "generate" in stages and not streaming_pass:
+        try:
+            print("Step 4: Generating and saving audio...")
+            step_start_time = time.time()
+            if per_scene_audio or stream_scenes:
+                generated_json = save_audio_per_scene_from_json(
+                    generated_json, audio_dir, generate_audio_with, elevenlabs_voice
+                )
+            else:
+                save_audio_from_json(
+                    generated_json, audio_dir, generate_audio_with, elevenlabs_voice
+                )
+            step_end_time = time.time()
+            print(f"Step 4 completed in {step_end_time - step_start_time:.2f} seconds.")
+            update_catalog(project, 4, "done", step_start_time, [("audio", os.path.join(audio_dir, project, f"{project}.mp3"))])
+        except Exception as e:
+            print(f"Error in Step 4: {e}")
+            traceback.print_exc()
+            failed_steps.append(4)
+            update_catalog(project, 4, "failed", step_start_time)
 
     # Step 5: Save transcription from JSON
-    try:
-        print("Step 5: Generating and saving transcription...")
-        step_start_time = time.time()
-        save_transcription_from_json(generated_json, trans_dir, audio_dir)
-        step_end_time = time.time()
-        print("Transcription generated and saved.")
-        print(f"Step 5 completed in {step_end_time - step_start_time:.2f} seconds.")
-    except Exception as e:
-        print(f"Error in Step 5: {e}")
-        traceback.print_exc()
+    if "generate" in stages:
+        try:
+            print("Step 5: Generating and saving transcription...")
+            step_start_time = time.time()
+            save_transcription_from_json(
+                generated_json, trans_dir, audio_dir, chunked=chunked_transcription, service=transcribe_with
+            )
+            step_end_time = time.time()
+            print("Transcription generated and saved.")
+            print(f"Step 5 completed in {step_end_time - step_start_time:.2f} seconds.")
+            transcript_path = os.path.join(trans_dir, project, f"{project}.json")
+            update_catalog(
+                project,
+                5,
+                "done",
+                step_start_time,
+                [("transcription", transcript_path), ("word_times", word_times_path(transcript_path))],
+            )
+        except Exception as e:
+            print(f"Error in Step 5: {e}")
+            traceback.print_exc()
+            failed_steps.append(5)
+            update_catalog(project, 5, "failed", step_start_time)
 
     # Step 6: Update and save scene times in JSON
-    try:
-        print("Step 6: Updating and saving scene times in JSON...")
-        step_start_time = time.time()
-        generated_json = update_and_save_scene_times(
-            generated_json, audio_dir, JSON_dir
-        )
-        step_end_time = time.time()
-        print("Scene times updated in JSON and saved.")
-        print(f"Step 6 completed in {step_end_time - step_start_time:.2f} seconds.")
-    except Exception as e:
-        print(f"Error in Step 6: {e}")
-        traceback.print_exc()
+    if "generate" in stages:
+        try:
+            print("Step 6: Updating and saving scene times in JSON...")
+            step_start_time = time.time()
+            if per_scene_audio or stream_scenes:
+                generated_json = save_scene_times(generated_json, JSON_dir)
+            elif align_scenes and get_provider("transcription", transcribe_with).capabilities["word_timestamps"]:
+                generated_json = update_scene_times_from_transcript(
+                    generated_json, audio_dir, trans_dir, JSON_dir
+                )
+            else:
+                generated_json = update_and_save_scene_times(
+                    generated_json, audio_dir, JSON_dir
+                )
+            scenes = generated_json["scenes"]
+            duration = scenes[-1].get("end") if scenes else None
+            step_end_time = time.time()
+            print("Scene times updated in JSON and saved.")
+            print(f"Step 6 completed in {step_end_time - step_start_time:.2f} seconds.")
+            update_catalog(
+                project,
+                6,
+                "done",
+                step_start_time,
+                [
+                    ("script", os.path.join(JSON_dir, project, f"{project}.json")),
+                    ("scene_times", scene_times_path(os.path.join(JSON_dir, project, f"{project}.json"))),
+                ],
+                duration=duration,
+            )
+        except Exception as e:
+            print(f"Error in Step 6: {e}")
+            traceback.print_exc()
+            failed_steps.append(6)
+            update_catalog(project, 6, "failed", step_start_time)
 
     # Step 7: Save video from JSON
-    try:
-        print("Step 7: Compiling and saving video...")
-        step_start_time = time.time()
-        video_path = save_video_from_json(generated_json, img_dir, audio_dir, video_dir)
-        step_end_time = time.time()
-        print("Video compiled and saved.")
-        print(f"Step 7 completed in {step_end_time - step_start_time:.2f} seconds.")
-    except Exception as e:
-        print(f"Error in Step 7: {e}")
-        traceback.print_exc()
+    if "render" in stages:
+        try:
+            print("Step 7: Compiling and saving video...")
+            step_start_time = time.time()
+            # Las versiones se generan en el último paso que renderiza frames
+            if stream_scenes:
+                # Si la generación corrió en otro worker, aquí se renderizan los segmentos a partir de sus imágenes y clips
+                if not streaming_pass:
+                    generated_json = stream_video_from_json(
+                        generated_json,
+                        img_dir,
+                        audio_dir,
+                        video_dir,
+                        generate_images_with,
+                        generate_audio_with,
+                        leonardo_model,
+                        elevenlabs_voice,
+                        renditions=RENDITIONS if renditions and not add_subtitles else None,
+                    )
+                video_path = os.path.join(video_dir, project, f"{project}.mp4")
+                if not os.path.exists(video_path):
+                    # La pasada de los pasos 3-4 falló antes de unir los segmentos
+                    raise FileNotFoundError(f"Streamed video was not rendered: {video_path}")
+            else:
+                video_path = save_video_from_json(
+                    generated_json,
+                    img_dir,
+                    audio_dir,
+                    video_dir,
+                    renditions=RENDITIONS if renditions and not add_subtitles else None,
+                    json_dir=JSON_dir,
+                )
+            step_end_time = time.time()
+            print("Video compiled and saved.")
+            print(f"Step 7 completed in {step_end_time - step_start_time:.2f} seconds.")
+            update_catalog(project, 7, "done", step_start_time, rendition_artifacts("video", video_path))
+        except Exception as e:
+            print(f"Error in Step 7: {e}")
+            traceback.print_exc()
+            failed_steps.append(7)
+            update_catalog(project, 7, "failed", step_start_time)
 
     # Step 8: Add subtitles to video
-    if add_subtitles:
+    if add_subtitles and "render" in stages:
         try:
             print("Step 8: Adding subtitles to video...")
             step_start_time = time.time()
-            add_subtitles_to_video(generated_json, video_dir, trans_dir)
+            add_subtitles_to_video(
+                generated_json,
+                video_dir,
+                trans_dir,
+                engine=subtitle_engine,
+                soft=soft_subtitles,
+                renditions=RENDITIONS if renditions else None,
+            )
             video_path_with_subtitles = os.path.join(
                 video_dir,
                 sanitize_title(generated_json["title"]),
@@ -159,28 +373,227 @@ def main(
             step_end_time = time.time()
             print("Subtitles added to video.")
             print(f"Step 8 completed in {step_end_time - step_start_time:.2f} seconds.")
+            update_catalog(project, 8, "done", step_start_time, rendition_artifacts("video_sub", video_path_with_subtitles))
         except Exception as e:
             print(f"Error in Step 8: {e}")
             traceback.print_exc()
+            failed_steps.append(8)
+            update_catalog(project, 8, "failed", step_start_time)
 
     # Step 9: Add music to video
-    if add_music:
+    if add_music and "render" in stages:
         try:
             print("Step 9: Adding music to video...")
             step_start_time = time.time()
-            add_background_music_to_video(
-                video_path_with_subtitles if add_subtitles else video_path, music_dir
+            final_video_path = (
+                video_path_with_subtitles if add_subtitles else video_path
             )
+            music_video_path = add_background_music_to_video(final_video_path, music_dir, ducking=duck_music)
+            music_artifacts = [("video_music", music_video_path)]
+            if renditions:
+                # La música se mezcla una vez y se copia a cada versión sin volver a codificar su video
+                rendition_videos = rendition_paths(final_video_path, RENDITIONS)
+                names = [r["name"] for r in RENDITIONS if os.path.exists(rendition_videos[r["name"]])]
+                music_renditions = add_music_to_renditions(music_video_path, [rendition_videos[name] for name in names])
+                music_artifacts += [(f"video_music:{name}", path) for name, path in zip(names, music_renditions)]
             step_end_time = time.time()
             print(f"Step 9 completed in {step_end_time - step_start_time:.2f} seconds.")
+            update_catalog(project, 9, "done", step_start_time, music_artifacts)
         except Exception as e:
             print(f"Error in Step 9: {e}")
             traceback.print_exc()
+            failed_steps.append(9)
+            update_catalog(project, 9, "failed", step_start_time)
+
+    # Step 10: Derive style variants from the caption-free video
+    if variants and "render" in stages:
+        try:
+            print("Step 10: Rendering style variants...")
+            step_start_time = time.time()
+            variant_paths = render_style_variants(
+                generated_json,
+                video_dir,
+                trans_dir,
+                music_dir,
+                variants,
+                engine=subtitle_engine,
+            )
+            step_end_time = time.time()
+            print(f"Step 10 completed in {step_end_time - step_start_time:.2f} seconds.")
+            update_catalog(
+                project,
+                10,
+                "done",
+                step_start_time,
+                [(f"variant:{name}", path) for name, path in variant_paths.items()],
+            )
+        except Exception as e:
+            print(f"Error in Step 10: {e}")
+            traceback.print_exc()
+            failed_steps.append(10)
+            update_catalog(project, 10, "failed", step_start_time)
+
+    # Conciliar el registro de costes con los saldos de los proveedores (como mucho una vez por hora)
+    try:
+        services = {"image": generate_images_with, "speech": generate_audio_with, "transcription": transcribe_with, "script": generate_scripts_with}
+        if not all(get_provider(kind, name).capabilities["offline"] for kind, name in services.items()):
+            reconcile_provider_balances()
+        catalog.update_project(project, cost=project_cost(project))
+        print(
+            f"Estimated cost: ${project_cost(project):.4f} for this project, "
+            f"${batch_cost(batch_id):.4f} for batch {batch_id}."
+        )
+    except Exception as e:
+        print(f"Error reconciling costs: {e}")
+        traceback.print_exc()
 
     end_time = time.time()
     print(
         f"Project pipeline completed successfully in {end_time - start_time:.2f} seconds."
     )
+    return failed_steps
+
+
+def run_fan_out(base_path, targets, **options):
+    """
+    Run the pipeline for a project and then for each of its (language, provider, voice) targets.
+
+    The targets reuse the project's script structure and images: their scripts are
+    translated in batches of languages and only the audio, transcription and renders are
+    produced again for each of them.
+
+    Args:
+    - base_path (str): Base path for project directories.
+    - targets (list): Targets as dicts with "language", "provider" and "voice".
+    - options: Keyword arguments of main for the source project.
+
+    Returns:
+    - dict: Maps the title of the source project and of each target to its failed steps.
+    """
+    # El proyecto y todos sus destinos comparten un lote para sumar su coste juntos
+    options = dict(options, batch_id=options.get("batch_id") or new_batch_id())
+    with open(os.path.join(base_path, "input.json"), "r", encoding="utf-8") as file:
+        input_json = json.load(file)
+    results = {input_json["title"]: main(base_path, input_json=input_json, **options)}
+    if 2 in results[input_json["title"]]:
+        print("The source script could not be generated; skipping the targets.")
+        return results
+
+    JSON_dir = create_project_structure(base_path)[4]
+    script_service = options.get("generate_scripts_with", "openai")
+    generated_json = generate_json(input_json, options["prompt_path"], JSON_dir, service=script_service)
+    target_jsons = generate_target_jsons(generated_json, targets, JSON_dir, service=script_service)
+    for target, target_json in zip(targets, target_jsons):
+        print(f"Fan-out target: {target['language']} with {target['provider']} voice {target['voice']}")
+        target_options = dict(options, generate_audio_with=target["provider"], elevenlabs_voice=target["voice"])
+        results[target_json["title"]] = main(base_path, input_json=target_json, **target_options)
+    return results
+
+
+def parse_targets(value):
+    """
+    Parse fan-out targets given as "language:provider:voice" separated by commas (e.g. "es:elevenlabs:<id>,fr:openai:nova").
+    """
+    targets = []
+    for item in value.split(","):
+        language, provider, voice = item.strip().split(":", 2)
+        if provider not in provider_names("speech"):
+            raise ValueError(f"Unknown audio provider in target '{item}'")
+        targets.append({"language": language, "provider": provider, "voice": voice})
+    return targets
+
+
+def run_worker(queue_path, base_path, stages=JOB_KINDS, worker_id=None, poll_interval=10):
+    """
+    Run a worker that takes jobs from the shared job queue and runs their pipeline stages.
+
+    Every worker uses the same base_path on shared storage, so any of them can pick up
+    a project another worker started: finished stage outputs are found on disk and
+    skipped. A finished "generate" job queues the project's "render" job.
+
+    Args:
+    - queue_path (str): Path to the shared job queue.
+    - base_path (str): Base path for project directories, on shared storage.
+    - stages (tuple): Job kinds this worker takes, e.g. ("render",) for a render-only box.
+    - worker_id (str): Identifier of this worker (defaults to host name and process ID).
+    - poll_interval (float): Seconds to wait when the queue has no job for this worker.
+
+    Returns:
+    - None
+    """
+    queue = JobQueue(queue_path)
+    worker_id = worker_id or default_worker_id()
+    print(f"Worker {worker_id} waiting for {', '.join(stages)} jobs in {queue_path}...")
+
+    while True:
+        job = queue.lease(worker_id, stages)
+        if job is None:
+            time.sleep(poll_interval)
+            continue
+
+        payload = job["payload"]
+        print(
+            f"Worker {worker_id} took {job['kind']} job {job['id']} for '{payload['input_json']['title']}' "
+            f"(attempt {job['attempts']})"
+        )
+        try:
+            with Heartbeat(queue, job["id"], worker_id) as heartbeat:
+                failed_steps = main(
+                    base_path,
+                    input_json=payload["input_json"],
+                    stages=(job["kind"],),
+                    **payload["options"],
+                )
+            if heartbeat.lost:
+                # Otro worker ya ha retomado el trabajo
+                continue
+            if failed_steps:
+                raise RuntimeError(f"Steps {failed_steps} failed")
+            if job["kind"] == "generate":
+                queue.enqueue("render", payload)
+            queue.complete(job["id"], worker_id)
+        except Exception as e:
+            print(f"Error in job {job['id']}: {e}")
+            traceback.print_exc()
+            queue.fail(job["id"], worker_id, e)
+
+
+def query_catalog(base_path, search=None, title=None, status=None, limit=50):
+    """
+    Print the projects in the catalog, or the stages and artifacts of one project.
+
+    Args:
+    - base_path (str): Base path for project directories.
+    - search (str): Only list projects whose title contains this text.
+    - title (str): Title of a project to show in detail instead of listing.
+    - status (str): Only list projects whose last stage has this status.
+    - limit (int): Maximum number of projects listed.
+
+    Returns:
+    - None
+    """
+    project_catalog = configure_catalog(catalog_path(base_path))
+    if title is not None:
+        project = project_catalog.get_project(sanitize_title(title))
+        if project is None:
+            print(f"Project '{title}' is not in the catalog.")
+            return
+        print(f"{project['title']} [{project['key']}]: {project['stage']} {project['status']}")
+        for stage in project["stages"]:
+            print(f"  Step {stage['step']} {stage['name']}: {stage['status']} in {stage['seconds'] or 0:.2f} seconds")
+        for artifact in project["artifacts"]:
+            print(f"  {artifact['kind']}: {artifact['path']} ({artifact['size'] / 1e6:.1f} MB)")
+        return
+
+    projects = project_catalog.list_projects(search=search, status=status, limit=limit)
+    total = project_catalog.count_projects(search=search, status=status)
+    for project in projects:
+        print(
+            f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(project['updated']))}  "
+            f"{project['stage'] or '-':<13} {project['status'] or '-':<6} "
+            f"{project['duration'] or 0:6.1f}s  ${project['cost'] or 0:7.4f}  {project['title']}"
+        )
+    print(f"{len(projects)} of {total} projects.")
 
 
 if __name__ == "__main__":
@@ -196,32 +609,48 @@ if __name__ == "__main__":
     parser.add_argument(
         "--prompt_path",
         type=str,
-        required=True,
         help="Path to the prompt template file.",
     )
     parser.add_argument(
         "--leonardo_model",
         type=str,
-        required=True,
         help="Model ID for Leonardo image generation.",
     )
     parser.add_argument(
         "--elevenlabs_voice",
         type=str,
-        required=True,
         help="Voice ID for ElevenLabs audio generation.",
     )
     parser.add_argument(
         "--images",
         type=str,
-        choices=["openai", "leonardo"],
-        help="Service to use for generating images.",
+        choices=provider_names("image"),
+        help="Image provider to use.",
     )
     parser.add_argument(
         "--audio",
         type=str,
-        choices=["openai", "elevenlabs"],
-        help="Service to use for generating audio.",
+        choices=provider_names("speech"),
+        help="Speech provider to use.",
+    )
+    parser.add_argument(
+        "--script",
+        type=str,
+        choices=provider_names("script"),
+        default="openai",
+        help="Script provider to use.",
+    )
+    parser.add_argument(
+        "--transcription",
+        type=str,
+        choices=provider_names("transcription"),
+        default="openai",
+        help="Transcription provider to use.",
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="Flag to use the offline providers for every service (procedural images, tone speech, synthetic timestamps, template scripts).",
     )
     parser.add_argument(
         "--music",
@@ -235,4 +664,180 @@ if __name__ == "__main__":
         default=True,
         help="Flag to add subtitles to the video.",
     )
+    parser.add_argument(
+        "--chunked_transcription",
+        action="store_true",
+        help="Flag to transcribe the audio in concurrent silence-aligned chunks.",
+    )
+    parser.add_argument(
+        "--per_scene_audio",
+        action="store_true",
+        help="Flag to synthesize each scene separately and take scene times from the clips.",
+    )
+    parser.add_argument(
+        "--stream_scenes",
+        action="store_true",
+        help="Flag to render each scene as soon as its image and audio are ready, joining scenes with hard cuts.",
+    )
+    parser.add_argument(
+        "--align_scenes",
+        action="store_true",
+        help="Flag to take scene times from the word-level transcription.",
+    )
+    parser.add_argument(
+        "--duck_music",
+        action="store_true",
+        help="Flag to lower the music under the narration and remux the audio.",
+    )
+    parser.add_argument(
+        "--subtitle_engine",
+        type=str,
+        choices=["moviepy", "ass"],
+        default="moviepy",
+        help="Caption engine: moviepy TextClip layers or an ASS track rendered by libass.",
+    )
+    parser.add_argument(
+        "--soft_subtitles",
+        action="store_true",
+        help="Flag to add a subtitle track instead of burning captions in (ass engine only).",
+    )
+    parser.add_argument(
+        "--renditions",
+        action="store_true",
+        help="Flag to encode 1080p, 720p and preview renditions plus a poster and GIF preview in the final render.",
+    )
+    parser.add_argument(
+        "--profile_renders",
+        action="store_true",
+        help="Flag to write a per-frame profile and a flame graph dump next to every rendered video.",
+    )
+    parser.add_argument(
+        "--variants",
+        type=str,
+        help="Path to a JSON list of style variants (name, captions style, music track, duck) derived from the caption-free render.",
+    )
+    parser.add_argument(
+        "--batch_id",
+        type=str,
+        help="Batch the provider costs are recorded under (defaults to one batch per run).",
+    )
+    parser.add_argument(
+        "--targets",
+        type=str,
+        help="Comma-separated language:provider:voice targets (e.g. es:elevenlabs:<voice id>,fr:openai:nova) to publish the video in, reusing its images.",
+    )
+    parser.add_argument(
+        "--list_projects",
+        nargs="?",
+        const="",
+        metavar="SEARCH",
+        help="List the projects in the catalog, optionally only those whose title contains SEARCH.",
+    )
+    parser.add_argument(
+        "--show_project",
+        type=str,
+        metavar="TITLE",
+        help="Show the stages and artifacts of a project in the catalog.",
+    )
+    parser.add_argument(
+        "--enqueue",
+        action="store_true",
+        help="Flag to add base_path/input.json to the job queue instead of running the pipeline here.",
+    )
+    parser.add_argument(
+        "--worker",
+        action="store_true",
+        help="Flag to run as a worker that takes jobs from the shared job queue.",
+    )
+    parser.add_argument(
+        "--worker_stages",
+        type=str,
+        default=",".join(JOB_KINDS),
+        help="Comma-separated job kinds this worker takes (generate, render).",
+    )
+    parser.add_argument(
+        "--queue_path",
+        type=str,
+        help="Path to the shared job queue (defaults to base_path/data/queue.sqlite).",
+    )
+    parser.add_argument(
+        "--worker_id",
+        type=str,
+        help="Identifier of this worker (defaults to host name and process ID).",
+    )
     args = parser.parse_args()
+
+    if args.offline:
+        args.images, args.audio = OFFLINE_PROVIDERS["image"], OFFLINE_PROVIDERS["speech"]
+        args.transcription, args.script = OFFLINE_PROVIDERS["transcription"], OFFLINE_PROVIDERS["script"]
+
+    querying = args.list_projects is not None or args.show_project is not None
+    if not args.worker and not querying:
+        required = {
+            "prompt_path": not get_provider("script", args.script).capabilities["offline"],
+            "leonardo_model": args.images == "leonardo",
+            "elevenlabs_voice": args.audio == "elevenlabs",
+        }
+        for name, needed in required.items():
+            if needed and getattr(args, name) is None:
+                parser.error(f"--{name} is required with these providers unless running with --worker or querying the catalog")
+
+    queue_path = args.queue_path or os.path.join(args.base_path, "data", "queue.sqlite")
+    options = {
+        "prompt_path": args.prompt_path,
+        "leonardo_model": args.leonardo_model,
+        "elevenlabs_voice": args.elevenlabs_voice,
+        "generate_images_with": args.images,
+        "generate_audio_with": args.audio,
+        "add_music": args.music,
+        "add_subtitles": args.subtitles,
+        "generate_scripts_with": args.script,
+        "transcribe_with": args.transcription,
+        "chunked_transcription": args.chunked_transcription,
+        "per_scene_audio": args.per_scene_audio,
+        "stream_scenes": args.stream_scenes,
+        "align_scenes": args.align_scenes,
+        "duck_music": args.duck_music,
+        "subtitle_engine": args.subtitle_engine,
+        "soft_subtitles": args.soft_subtitles,
+        "renditions": args.renditions,
+        "profile_renders": args.profile_renders,
+        "variants": None,
+        "batch_id": args.batch_id,
+    }
+
+    if args.variants:
+        with open(args.variants, "r", encoding="utf-8") as file:
+            options["variants"] = json.load(file)
+
+    targets = None
+    if args.targets:
+        if args.worker or args.enqueue:
+            parser.error("--targets cannot be combined with --worker or --enqueue")
+        try:
+            targets = parse_targets(args.targets)
+        except ValueError as e:
+            parser.error(f"Invalid --targets: {e}")
+
+    if querying:
+        query_catalog(args.base_path, search=args.list_projects, title=args.show_project)
+    elif targets:
+        run_fan_out(args.base_path, targets, **options)
+    elif args.worker:
+        run_worker(
+            queue_path,
+            args.base_path,
+            stages=tuple(args.worker_stages.split(",")),
+            worker_id=args.worker_id,
+        )
+    elif args.enqueue:
+        with open(os.path.join(args.base_path, "input.json"), "r", encoding="utf-8") as file:
+            input_json = json.load(file)
+        # Los trabajos generate y render del proyecto registran sus costes en el mismo lote
+        options["batch_id"] = options["batch_id"] or new_batch_id()
+        job_id = JobQueue(queue_path).enqueue(
+            "generate", {"input_json": input_json, "options": options}
+        )
+        print(f"Queued generate job {job_id} for '{input_json['title']}' in {queue_path}")
+    else:
+        main(args.base_path, **options)
@@ -0,0 +1,325 @@
+import os
+import statistics
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+from store_funcs import atomic_write
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+ENCODER_SAMPLE_SECONDS = 0.2  # Cada cuánto se lee la memoria del codificador
+STALL_SECONDS = 0.05  # Una escritura al codificador más lenta que esto cuenta como atasco
+HISTOGRAM_BUCKETS_MS = [5, 10, 20, 40, 80, 160, 320, 640]
+
+_settings = {"enabled": False}
+_active = threading.local()
+
+
+def configure_profiling(enabled):
+    """
+    Turn render profiling on or off for every render started afterwards.
+    """
+    _settings["enabled"] = bool(enabled)
+
+
+def profile_section(name):
+    """
+    Time a block as a section of the render being profiled in this thread (a no-op otherwise).
+
+    Args:
+    - name (str): Section name, e.g. "pan", "blend" or "captions".
+
+    Returns:
+    - context manager
+    """
+    profiler = getattr(_active, "profiler", None)
+    return profiler.section(name) if profiler is not None else nullcontext()
+
+
+def peak_rss_mb():
+    """
+    Peak resident memory of this process and of the largest child process it has waited for, in MB.
+
+    Both are high-water marks over the whole life of the process, not of one render.
+
+    Returns:
+    - tuple: (self, children), or (None, None) where the resource module is unavailable.
+    """
+    if resource is None:
+        return None, None
+    # ru_maxrss está en KB en Linux
+    return (
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    )
+
+
+def process_peak_rss_mb(pid):
+    """
+    Peak resident memory (VmHWM) of a running process in MB.
+
+    Returns:
+    - float: The peak, or None once the process has exited or where /proc is unavailable.
+    """
+    try:
+        with open(f"/proc/{pid}/status", "r") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+@contextmanager
+def watch_encoder(process, interval=ENCODER_SAMPLE_SECONDS):
+    """
+    Sample the peak memory of an encoder process while the block runs, for the render being profiled in this thread (a no-op otherwise).
+
+    Args:
+    - process (Popen): The encoder, e.g. the ffmpeg frames are piped into.
+    - interval (float): Seconds between samples.
+
+    Returns:
+    - context manager
+    """
+    profiler = getattr(_active, "profiler", None)
+    if profiler is None:
+        yield
+        return
+
+    done = threading.Event()
+
+    def sample():
+        # VmHWM solo crece, así que la última lectura antes de que el proceso termine es su pico
+        while True:
+            rss = process_peak_rss_mb(process.pid)
+            if rss is not None:
+                profiler.encoder_rss = max(profiler.encoder_rss or 0.0, rss)
+            if done.wait(interval):
+                return
+
+    thread = threading.Thread(target=sample, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        done.set()
+        thread.join()
+
+
+class RenderProfiler:
+    """
+    Per-frame timings of one render, split into nested sections.
+
+    Frames are timed by wrapping the clip being written: the time spent producing
+    each frame is split into the sections opened while it was being made, and the
+    time between handing a frame over and being asked for the next one is the
+    encoder write, including pipe backpressure. Section times are self times: a
+    section's time excludes the sections nested in it.
+    """
+
+    def __init__(self, name, stall_seconds=STALL_SECONDS):
+        self.name = name
+        self.stall_seconds = stall_seconds
+        self.local = threading.local()
+        self.self_times = defaultdict(float)
+        self.frames = []
+        self.current = None
+        self.last_frame_end = None
+        self.started = time.perf_counter()
+        self.elapsed = None
+        self.encoder_rss = None
+
+    @contextmanager
+    def section(self, name):
+        if not hasattr(self.local, "stack"):
+            self.local.stack = [self.name]
+            self.local.child_times = [0.0]
+        stack, child_times = self.local.stack, self.local.child_times
+        stack.append(name)
+        child_times.append(0.0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            own = elapsed - child_times.pop()
+            self.self_times[";".join(stack)] += own
+            stack.pop()
+            child_times[-1] += elapsed
+            if self.current is not None:
+                self.current[name] = self.current.get(name, 0.0) + own
+
+    def record_encode(self, now):
+        if self.last_frame_end is None:
+            return
+        gap = now - self.last_frame_end
+        self.self_times[f"{self.name};encode"] += gap
+        self.frames[-1]["encode"] = gap
+        self.last_frame_end = None
+
+    def wrap(self, clip):
+        """
+        Wrap a clip so every frame and audio chunk it produces is timed.
+
+        Args:
+        - clip (VideoClip): The clip about to be written.
+
+        Returns:
+        - VideoClip: The same clip with timed frames and audio.
+        """
+        def timed_frame(get_frame, t):
+            if self.frames and t <= self.frames[-1]["t"]:
+                # El escritor pidió antes este frame para sondear el clip: no es parte del bucle
+                self.frames.pop()
+                self.last_frame_end = None
+            self.record_encode(time.perf_counter())
+            self.current = {"t": t}
+            with self.section("frame"):
+                frame = get_frame(t)
+            self.frames.append(self.current)
+            self.current = None
+            self.last_frame_end = time.perf_counter()
+            return frame
+
+        def timed_audio(get_frame, t):
+            with self.section("audio"):
+                return get_frame(t)
+
+        wrapped = clip.fl(timed_frame)
+        if clip.audio is not None:
+            wrapped = wrapped.set_audio(clip.audio.fl(timed_audio))
+        return wrapped
+
+    def finish(self):
+        """
+        Record the encoder flush after the last frame and stop the render clock.
+        """
+        if self.last_frame_end is not None:
+            self.self_times[f"{self.name};encode;finalize"] += time.perf_counter() - self.last_frame_end
+            self.last_frame_end = None
+        self.elapsed = time.perf_counter() - self.started
+
+    def summary(self):
+        """
+        Summary of the render as lines of text: totals, per-section percentiles, a frame-time histogram and the slowest frames.
+        """
+        # Los tiempos propios de las secciones de un frame suman su tiempo total
+        frame_totals = [sum(seconds for name, seconds in frame.items() if name != "t") for frame in self.frames]
+        encode_times = [frame.get("encode", 0.0) for frame in self.frames]
+        stalls = [gap for gap in encode_times if gap > self.stall_seconds]
+        rss_self, rss_children = peak_rss_mb()
+
+        lines = [f"Render profile: {self.name}"]
+        lines.append(f"Frames: {len(self.frames)} in {self.elapsed or 0:.2f} s ({len(self.frames) / (self.elapsed or 1):.1f} fps)")
+        lines.append(f"Encoder stalls (> {self.stall_seconds * 1000:.0f} ms): {len(stalls)}, {sum(stalls):.2f} s")
+        if self.encoder_rss is not None:
+            lines.append(f"Encoder peak RSS: {self.encoder_rss:.0f} MB")
+        if rss_self is not None:
+            lines.append(
+                f"Peak RSS since the process started: {rss_self:.0f} MB "
+                f"(largest finished child process: {rss_children:.0f} MB)"
+            )
+
+        lines.append("")
+        lines.append("Per-frame self time of each section (excluding the sections nested in it):")
+        lines.append(f"{'Section':<12}{'total s':>10}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+        sections = sorted({name for frame in self.frames for name in frame if name != "t"})
+        for name in sections:
+            times = sorted(frame.get(name, 0.0) * 1000 for frame in self.frames)
+            p95 = times[min(len(times) - 1, int(len(times) * 0.95))]
+            lines.append(
+                f"{name:<12}{sum(times) / 1000:>10.2f}{statistics.fmean(times):>10.2f}"
+                f"{statistics.median(times):>10.2f}{p95:>10.2f}{times[-1]:>10.2f}"
+            )
+        audio_time = sum(seconds for stack, seconds in self.self_times.items() if stack.endswith(";audio"))
+        if audio_time:
+            lines.append(f"{'audio':<12}{audio_time:>10.2f}  (written in chunks, outside the frame loop)")
+        finalize_time = self.self_times.get(f"{self.name};encode;finalize", 0.0)
+        if finalize_time:
+            lines.append(f"{'finalize':<12}{finalize_time:>10.2f}  (encoder flush after the last frame)")
+
+        lines.append("")
+        lines.append("Frame time histogram (frame + encode):")
+        bounds = HISTOGRAM_BUCKETS_MS + [float("inf")]
+        counts = [0] * len(bounds)
+        for total in frame_totals:
+            counts[next(i for i, bound in enumerate(bounds) if total * 1000 < bound)] += 1
+        lower = 0
+        for bound, count in zip(bounds, counts):
+            label = f"{lower}-{bound} ms" if bound != float("inf") else f">= {lower} ms"
+            bar = "#" * round(50 * count / max(1, len(frame_totals)))
+            lines.append(f"{label:>14} {count:>7} {bar}")
+            lower = bound
+
+        lines.append("")
+        lines.append("Slowest frames:")
+        slowest = sorted(range(len(self.frames)), key=lambda i: frame_totals[i], reverse=True)[:10]
+        for i in slowest:
+            frame = self.frames[i]
+            parts = ", ".join(f"{name} {frame[name] * 1000:.1f}" for name in sections if name in frame)
+            lines.append(f"  frame {i} at {frame['t']:.2f} s: {frame_totals[i] * 1000:.1f} ms ({parts})")
+        return lines
+
+    def write_reports(self, output_path):
+        """
+        Write the summary and a collapsed-stack dump next to the rendered file.
+
+        The collapsed-stack file has one "render;frame;blend;pan <microseconds>" line per
+        stack with its self time, the input format of flamegraph.pl and speedscope.
+
+        Args:
+        - output_path (str): Path of the rendered file.
+
+        Returns:
+        - tuple: Paths of the summary and the collapsed-stack file.
+        """
+        base = os.path.splitext(output_path)[0]
+        summary_path, folded_path = f"{base}_profile.txt", f"{base}_profile.folded"
+        with atomic_write(summary_path) as file:
+            file.write("\n".join(self.summary()) + "\n")
+        with atomic_write(folded_path) as file:
+            for stack, seconds in sorted(self.self_times.items()):
+                file.write(f"{stack} {max(0, round(seconds * 1e6))}\n")
+        return summary_path, folded_path
+
+
+class NullProfiler:
+    """
+    Stand-in used when profiling is off; leaves clips untouched.
+    """
+
+    def wrap(self, clip):
+        return clip
+
+
+@contextmanager
+def render_profile(output_path):
+    """
+    Profile the render of output_path in this thread if profiling is enabled, writing its reports afterwards.
+
+    Args:
+    - output_path (str): Path of the file being rendered.
+
+    Returns:
+    - context manager yielding a RenderProfiler, or a NullProfiler when profiling is off.
+    """
+    if not _settings["enabled"]:
+        yield NullProfiler()
+        return
+
+    profiler = RenderProfiler(os.path.basename(output_path))
+    _active.profiler = profiler
+    try:
+        yield profiler
+    finally:
+        _active.profiler = None
+        profiler.finish()
+        summary_path, _ = profiler.write_reports(output_path)
+        print(f"Render profile saved to {summary_path}")
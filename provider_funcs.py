@@ -0,0 +1,353 @@
+import asyncio
+import hashlib
+import re
+from abc import ABC, abstractmethod
+
+import numpy as np
+import requests
+from PIL import Image, ImageDraw, ImageFilter
+from pydub import AudioSegment
+from pydub.generators import Sine
+
+from store_funcs import atomic_output, atomic_write
+
+PROVIDERS = {"image": {}, "speech": {}, "transcription": {}, "script": {}}
+OFFLINE_PROVIDERS = {"image": "procedural", "speech": "tone", "transcription": "synthetic", "script": "template"}
+HERO_JOURNEY_PHASES = [
+    "Introduction",
+    "Call to Adventure",
+    "Crossing the Threshold",
+    "Tests, Allies, Enemies",
+    "The Ordeal",
+    "The Reward",
+    "Return with the Elixir",
+]
+
+
+class Provider(ABC):
+    """
+    Base class of every provider.
+
+    The interface methods are abstract, so a provider missing one fails when it is
+    instantiated for registration instead of in the middle of a run.
+
+    Capabilities:
+    - max_batch: items one request can handle (e.g. languages per translation).
+    - concurrency: requests worth running at the same time.
+    - word_timestamps: whether transcriptions come with word-level timestamps.
+    - offline: whether the provider works without network access.
+    """
+
+    kind = None
+    name = None
+    capabilities = {"max_batch": 1, "concurrency": 4, "word_timestamps": False, "offline": False}
+
+
+class ImageProvider(Provider):
+    kind = "image"
+
+    @abstractmethod
+    def generate_image(self, prompt, output_path, project=None, model=None):
+        """
+        Generate an image for a prompt and save it as PNG at output_path.
+        """
+
+    async def agenerate_image(self, *args, **kwargs):
+        return await asyncio.to_thread(self.generate_image, *args, **kwargs)
+
+
+class SpeechProvider(Provider):
+    kind = "speech"
+
+    @abstractmethod
+    def synthesize(self, text, output_path, voice=None, language="en", project=None):
+        """
+        Synthesize text into an MP3 file at output_path.
+        """
+
+    async def asynthesize(self, *args, **kwargs):
+        return await asyncio.to_thread(self.synthesize, *args, **kwargs)
+
+
+class TranscriptionProvider(Provider):
+    kind = "transcription"
+
+    @abstractmethod
+    def transcribe(self, audio_path, language="en", script=None, chunked=False, project=None):
+        """
+        Transcribe an audio file.
+
+        Returns:
+        - dict: "text" and "segments", a list of words with "word", "start" and "end".
+        """
+
+    async def atranscribe(self, *args, **kwargs):
+        return await asyncio.to_thread(self.transcribe, *args, **kwargs)
+
+
+class ScriptProvider(Provider):
+    kind = "script"
+
+    @abstractmethod
+    def generate_script(self, formatted_prompt, input_json, project=None):
+        """
+        Generate the video script JSON (title, topic, description, SEO and scenes).
+        """
+
+    @abstractmethod
+    def translate_scripts(self, scripts, languages, source_language="en", project=None):
+        """
+        Translate scene scripts into several languages.
+
+        Returns:
+        - dict: Maps each language to its list of scripts, in the same order.
+        """
+
+    async def agenerate_script(self, *args, **kwargs):
+        return await asyncio.to_thread(self.generate_script, *args, **kwargs)
+
+    async def atranslate_scripts(self, *args, **kwargs):
+        return await asyncio.to_thread(self.translate_scripts, *args, **kwargs)
+
+
+def register_provider(provider):
+    """
+    Add a provider instance to the registry under its kind and name.
+
+    Returns:
+    - Provider: The same provider.
+    """
+    PROVIDERS[provider.kind][provider.name] = provider
+    return provider
+
+
+def get_provider(kind, name):
+    """
+    Look up a registered provider.
+
+    Args:
+    - kind (str): "image", "speech", "transcription" or "script".
+    - name (str): Provider name, e.g. "openai" or "procedural".
+
+    Returns:
+    - Provider: The registered provider.
+    """
+    try:
+        return PROVIDERS[kind][name]
+    except KeyError:
+        raise ValueError(f"Unknown {kind} provider '{name}'. Available: {', '.join(provider_names(kind))}") from None
+
+
+def provider_names(kind):
+    """
+    Names of the registered providers of a kind.
+    """
+    return sorted(PROVIDERS[kind])
+
+
+def download_image(image_url, output_path):
+    response = requests.get(image_url)
+    response.raise_for_status()
+    with atomic_write(output_path, "wb") as file:
+        file.write(response.content)
+    return output_path
+
+
+# Los proveedores en línea importan generation_funcs al usarse, que a su vez usa este registro
+
+class OpenAIImageProvider(ImageProvider):
+    name = "openai"
+    capabilities = dict(Provider.capabilities, concurrency=4)
+
+    def generate_image(self, prompt, output_path, project=None, model=None):
+        from generation_funcs import generate_image_openai
+        return download_image(generate_image_openai(prompt, project=project), output_path)
+
+
+class LeonardoImageProvider(ImageProvider):
+    name = "leonardo"
+    capabilities = dict(Provider.capabilities, concurrency=4)
+
+    def generate_image(self, prompt, output_path, project=None, model=None):
+        from generation_funcs import generate_image_leonardo
+        return download_image(generate_image_leonardo(prompt, model, project=project), output_path)
+
+
+class OpenAISpeechProvider(SpeechProvider):
+    name = "openai"
+    capabilities = dict(Provider.capabilities, concurrency=4)
+
+    def synthesize(self, text, output_path, voice=None, language="en", project=None):
+        from generation_funcs import DEFAULT_OPENAI_VOICE, OPENAI_VOICES, generate_audio_openai
+        voice = voice if voice in OPENAI_VOICES else DEFAULT_OPENAI_VOICE
+        generate_audio_openai(text, output_path, project=project, voice=voice)
+        return output_path
+
+
+class ElevenLabsSpeechProvider(SpeechProvider):
+    name = "elevenlabs"
+    capabilities = dict(Provider.capabilities, concurrency=4)
+
+    def synthesize(self, text, output_path, voice=None, language="en", project=None):
+        from generation_funcs import generate_audio_elevenlabs
+        generate_audio_elevenlabs(text, output_path, voice, project=project, language=language)
+        return output_path
+
+
+class OpenAITranscriptionProvider(TranscriptionProvider):
+    name = "openai"
+    capabilities = dict(Provider.capabilities, concurrency=4, word_timestamps=True)
+
+    def transcribe(self, audio_path, language="en", script=None, chunked=False, project=None):
+        from generation_funcs import transcribe_audio, transcribe_audio_chunked
+        if chunked:
+            return transcribe_audio_chunked(audio_path, max_workers=self.capabilities["concurrency"], project=project, language=language)
+        return transcribe_audio(audio_path, project=project, language=language)
+
+
+class OpenAIScriptProvider(ScriptProvider):
+    name = "openai"
+    # Cuántos idiomas caben en una traducción sin pasar del contexto de gpt-4
+    capabilities = dict(Provider.capabilities, max_batch=4, concurrency=2)
+
+    def generate_script(self, formatted_prompt, input_json, project=None):
+        from generation_funcs import generate_script_openai
+        return generate_script_openai(formatted_prompt, project=project)
+
+    def translate_scripts(self, scripts, languages, source_language="en", project=None):
+        from generation_funcs import translate_scripts
+        return translate_scripts(scripts, languages, source_language, project=project)
+
+
+class ProceduralImageProvider(ImageProvider):
+    """
+    Offline images: a gradient with soft shapes, seeded by the prompt so the same prompt gives the same image.
+    """
+
+    name = "procedural"
+    capabilities = dict(Provider.capabilities, concurrency=8, offline=True)
+    size = 1024
+
+    def generate_image(self, prompt, output_path, project=None, model=None):
+        rng = np.random.default_rng(int.from_bytes(hashlib.sha256(prompt.encode("utf-8")).digest()[:8], "little"))
+        top, bottom = rng.integers(0, 256, size=(2, 3))
+        ramp = np.linspace(0.0, 1.0, self.size)[:, None, None]
+        pixels = (top * (1 - ramp) + bottom * ramp) * np.ones((1, self.size, 1))
+        image = Image.fromarray(pixels.astype(np.uint8))
+
+        shapes = Image.new("RGB", image.size)
+        mask = Image.new("L", image.size)
+        draw, draw_mask = ImageDraw.Draw(shapes), ImageDraw.Draw(mask)
+        for _ in range(12):
+            x, y = rng.integers(0, self.size, size=2)
+            radius = int(rng.integers(self.size // 20, self.size // 5))
+            box = [x - radius, y - radius, x + radius, y + radius]
+            draw.ellipse(box, fill=tuple(int(c) for c in rng.integers(0, 256, size=3)))
+            draw_mask.ellipse(box, fill=int(rng.integers(80, 200)))
+        image.paste(shapes, mask=mask.filter(ImageFilter.GaussianBlur(self.size // 100)))
+        with atomic_write(output_path, "wb") as file:
+            image.save(file, format="PNG")
+        return output_path
+
+
+def offline_word_durations(words):
+    """
+    Duration in seconds the offline voice gives each word, growing with its length.
+    """
+    return [0.08 + 0.05 * len(word) for word in words]
+
+
+OFFLINE_WORD_GAP = 0.08  # Silencio entre palabras de la voz sin conexión
+
+
+class ToneSpeechProvider(SpeechProvider):
+    """
+    Offline speech: a soft tone burst per word with short gaps, paced like real narration.
+    """
+
+    name = "tone"
+    capabilities = dict(Provider.capabilities, concurrency=8, offline=True)
+
+    def synthesize(self, text, output_path, voice=None, language="en", project=None):
+        gap = AudioSegment.silent(duration=OFFLINE_WORD_GAP * 1000)
+        audio = AudioSegment.empty()
+        for duration in offline_word_durations(text.split()):
+            audio += Sine(220).to_audio_segment(duration=duration * 1000, volume=-20).fade_in(10).fade_out(10)
+            audio += gap
+        with atomic_output(output_path) as temp_path:
+            audio.export(temp_path, format="mp3")
+        return output_path
+
+
+class SyntheticTranscriptionProvider(TranscriptionProvider):
+    """
+    Offline transcription: word timestamps synthesized from the known script, spread over the audio.
+
+    Timings follow the offline voice's pacing scaled to the audio duration, so they
+    are exact for audio from ToneSpeechProvider and approximate for any other audio.
+    """
+
+    name = "synthetic"
+    capabilities = dict(Provider.capabilities, concurrency=8, word_timestamps=True, offline=True)
+
+    def transcribe(self, audio_path, language="en", script=None, chunked=False, project=None):
+        if not script:
+            raise ValueError("The synthetic transcription provider needs the script text")
+        words = script.split()
+        durations = offline_word_durations(words)
+        scale = (len(AudioSegment.from_file(audio_path)) / 1000.0) / (sum(durations) + OFFLINE_WORD_GAP * len(words))
+        segments = []
+        current = 0.0
+        for word, duration in zip(words, durations):
+            segments.append({"word": word, "start": current * scale, "end": (current + duration) * scale})
+            current += duration + OFFLINE_WORD_GAP
+        return {"text": script, "segments": segments}
+
+
+class TemplateScriptProvider(ScriptProvider):
+    """
+    Offline scripts built from the input details following the Hero's Journey phases; translation keeps the scripts as they are.
+    """
+
+    name = "template"
+    capabilities = dict(Provider.capabilities, max_batch=100, concurrency=8, offline=True)
+
+    def generate_script(self, formatted_prompt, input_json, project=None):
+        title, topic, description = input_json["title"], input_json["topic"], input_json["description"]
+        sentences = [sentence for sentence in re.split(r"(?<=[.!?])\s+", description.strip()) if sentence] or [title]
+        scripts = [f"This is the legendary story of {title}."]
+        scripts += [sentences[i % len(sentences)] for i in range(len(HERO_JOURNEY_PHASES) - 2)]
+        scripts.append(f"What do you think about {title}? Like, share, and comment below!")
+        return {
+            "title": title,
+            "topic": topic,
+            "description": description,
+            "SEO": f"{description} #{re.sub(r'[^0-9A-Za-z]', '', title)} #{re.sub(r'[^0-9A-Za-z]', '', topic)}",
+            "scenes": [
+                {
+                    "order": order,
+                    "phase": phase,
+                    "script": script,
+                    "image_prompt": f"{title}, {topic}: {phase}. {script} Photorealistic, cinematic lighting, high detail.",
+                }
+                for order, (phase, script) in enumerate(zip(HERO_JOURNEY_PHASES, scripts), start=1)
+            ],
+        }
+
+    def translate_scripts(self, scripts, languages, source_language="en", project=None):
+        return {language: list(scripts) for language in languages}
+
+
+for provider in (
+    OpenAIImageProvider(),
+    LeonardoImageProvider(),
+    ProceduralImageProvider(),
+    OpenAISpeechProvider(),
+    ElevenLabsSpeechProvider(),
+    ToneSpeechProvider(),
+    OpenAITranscriptionProvider(),
+    SyntheticTranscriptionProvider(),
+    OpenAIScriptProvider(),
+    TemplateScriptProvider(),
+):
+    register_provider(provider)
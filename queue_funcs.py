@@ -0,0 +1,197 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+JOB_KINDS = ("generate", "render")
+LEASE_SECONDS = 120  # Un trabajo sin latido durante este tiempo vuelve a la cola
+MAX_ATTEMPTS = 3
+
+
+class JobQueue:
+    """
+    Lease-based job queue stored in a SQLite file on storage shared by every worker.
+
+    A worker leases a job for LEASE_SECONDS and keeps it alive with heartbeats; if the
+    worker dies, the lease expires and the job is queued again for another worker.
+    Every operation opens its own connection inside an immediate transaction, so
+    several processes and hosts can use the same file. The shared filesystem must
+    support POSIX locks (e.g. NFSv4 with locking enabled).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self.transaction() as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    worker TEXT,
+                    lease_expires REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    created REAL NOT NULL,
+                    updated REAL NOT NULL
+                )
+            """)
+            connection.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, kind, id)")
+
+    @contextmanager
+    def transaction(self):
+        """
+        Open a connection running in an immediate (write-locked) transaction for the `with` block.
+        """
+        connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            yield connection
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        finally:
+            connection.close()
+
+    def enqueue(self, kind, payload):
+        """
+        Add a job to the queue.
+
+        Args:
+        - kind (str): Job kind, one of JOB_KINDS.
+        - payload (dict): JSON-serializable job data.
+
+        Returns:
+        - int: ID of the new job.
+        """
+        if kind not in JOB_KINDS:
+            raise ValueError(f"Unknown job kind: {kind}")
+        now = time.time()
+        with self.transaction() as connection:
+            cursor = connection.execute(
+                "INSERT INTO jobs (kind, payload, created, updated) VALUES (?, ?, ?, ?)",
+                (kind, json.dumps(payload, ensure_ascii=False), now, now),
+            )
+            return cursor.lastrowid
+
+    def lease(self, worker_id, kinds=JOB_KINDS, lease_seconds=LEASE_SECONDS):
+        """
+        Lease the oldest queued job of the given kinds, re-queueing expired leases first.
+
+        Args:
+        - worker_id (str): Identifier of the worker taking the job.
+        - kinds (tuple): Job kinds this worker handles.
+        - lease_seconds (float): Length of the lease.
+
+        Returns:
+        - dict: The leased job ("id", "kind", "payload", "attempts"), or None if there is none.
+        """
+        now = time.time()
+        with self.transaction() as connection:
+            # Los trabajos de workers caídos vuelven a la cola (o fallan tras MAX_ATTEMPTS)
+            connection.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END, "
+                "worker = NULL, error = 'lease expired', updated = ? WHERE status = 'leased' AND lease_expires < ?",
+                (MAX_ATTEMPTS, now, now),
+            )
+            placeholders = ", ".join("?" for _ in kinds)
+            row = connection.execute(
+                f"SELECT id, kind, payload, attempts FROM jobs WHERE status = 'queued' AND kind IN ({placeholders}) ORDER BY id LIMIT 1",
+                tuple(kinds),
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute(
+                "UPDATE jobs SET status = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1, updated = ? WHERE id = ?",
+                (worker_id, now + lease_seconds, now, row[0]),
+            )
+        return {"id": row[0], "kind": row[1], "payload": json.loads(row[2]), "attempts": row[3] + 1}
+
+    def heartbeat(self, job_id, worker_id, lease_seconds=LEASE_SECONDS):
+        """
+        Extend the lease of a job still held by this worker.
+
+        Returns:
+        - bool: False if the lease was lost (expired and taken by another worker).
+        """
+        now = time.time()
+        with self.transaction() as connection:
+            cursor = connection.execute(
+                "UPDATE jobs SET lease_expires = ?, updated = ? WHERE id = ? AND worker = ? AND status = 'leased'",
+                (now + lease_seconds, now, job_id, worker_id),
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, job_id, worker_id):
+        """
+        Mark a leased job as done.
+        """
+        with self.transaction() as connection:
+            connection.execute(
+                "UPDATE jobs SET status = 'done', lease_expires = NULL, updated = ? WHERE id = ? AND worker = ?",
+                (time.time(), job_id, worker_id),
+            )
+
+    def fail(self, job_id, worker_id, error):
+        """
+        Release a leased job after an error: queue it again, or mark it failed after MAX_ATTEMPTS.
+        """
+        with self.transaction() as connection:
+            connection.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END, "
+                "worker = NULL, lease_expires = NULL, error = ?, updated = ? WHERE id = ? AND worker = ?",
+                (MAX_ATTEMPTS, str(error), time.time(), job_id, worker_id),
+            )
+
+    def counts(self):
+        """
+        Number of jobs per (kind, status).
+        """
+        with self.transaction() as connection:
+            rows = connection.execute("SELECT kind, status, COUNT(*) FROM jobs GROUP BY kind, status").fetchall()
+        return {(kind, status): count for kind, status, count in rows}
+
+
+class Heartbeat:
+    """
+    Background thread that keeps a job's lease alive while it runs.
+    """
+
+    def __init__(self, queue, job_id, worker_id, lease_seconds=LEASE_SECONDS):
+        self.queue = queue
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.stopped = threading.Event()
+        self.lost = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(self.lease_seconds / 3):
+            try:
+                if not self.queue.heartbeat(self.job_id, self.worker_id, self.lease_seconds):
+                    self.lost = True
+                    print(f"Lease lost for job {self.job_id}")
+                    return
+            except sqlite3.Error as e:
+                print(f"Heartbeat failed for job {self.job_id}: {e}")
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.stopped.set()
+        self.thread.join()
+
+
+def default_worker_id():
+    """
+    Worker identifier made of the host name and process ID.
+    """
+    return f"{socket.gethostname()}-{os.getpid()}"
@@ -0,0 +1,250 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import httpx
+import requests
+
+# Cuotas por proveedor: peticiones por minuto y unidades (tokens o caracteres) por minuto
+PROVIDER_LIMITS = {
+    "openai": {"requests_per_minute": 50, "units_per_minute": 150000},
+    "leonardo": {"requests_per_minute": 30, "units_per_minute": None},
+    "elevenlabs": {"requests_per_minute": 60, "units_per_minute": 50000},
+}
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504}
+
+
+class ProviderError(Exception):
+    """
+    Error returned by a provider HTTP endpoint, with its status code and Retry-After delay.
+    """
+
+    def __init__(self, message, status_code=None, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled continuously up to a per-minute capacity.
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, amount=1):
+        """
+        Block until `amount` tokens are available and take them.
+
+        Requests larger than the bucket capacity wait for a full bucket and drain it.
+        """
+        amount = min(float(amount), self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker that opens after consecutive failures.
+
+    While open, calls wait for the cool-down. The circuit is then half-open: exactly
+    one call is let through as a probe while the others keep waiting. A successful
+    probe closes the circuit and a failed one opens it for another cool-down.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """
+        Block until a call is allowed.
+
+        Returns:
+        - bool: Whether the call is the half-open probe; its outcome must then be
+          reported with record_success, record_failure or release.
+        """
+        with self.condition:
+            while True:
+                if self.opened_at is None:
+                    return False
+                wait = self.opened_at + self.reset_timeout - time.monotonic()
+                if wait <= 0 and not self.probing:
+                    self.probing = True
+                    return True
+                # Con la sonda en curso se espera a su resultado
+                self.condition.wait(wait if wait > 0 else None)
+
+    def record_success(self):
+        with self.condition:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+            self.condition.notify_all()
+
+    def record_failure(self, probe=False):
+        with self.condition:
+            self.failures += 1
+            if probe or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            if probe:
+                self.probing = False
+                self.condition.notify_all()
+
+    def release(self, probe=False):
+        """
+        End a call whose outcome says nothing about the provider's health, letting another probe through.
+        """
+        if not probe:
+            return
+        with self.condition:
+            self.probing = False
+            self.condition.notify_all()
+
+
+def parse_retry_after(value):
+    """
+    Parse a Retry-After header given either in seconds or as an HTTP date.
+
+    Returns:
+    - float: Delay in seconds, or None if the header is missing or invalid.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_info(error):
+    """
+    Decide whether a provider error is worth retrying.
+
+    Args:
+    - error (Exception): The exception raised by the provider call.
+
+    Returns:
+    - tuple: (retryable, retry_after seconds or None)
+    """
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout, httpx.TransportError)):
+        return True, None
+    status_code = getattr(error, "status_code", None)
+    retry_after = getattr(error, "retry_after", None)
+    response = getattr(error, "response", None)
+    if status_code is None and response is not None:
+        status_code = getattr(response, "status_code", None)
+    if retry_after is None and response is not None:
+        retry_after = parse_retry_after(getattr(response, "headers", {}).get("retry-after"))
+    if status_code is None:
+        # Errores de conexión del SDK de OpenAI (APIConnectionError, APITimeoutError)
+        return type(error).__name__ in ("APIConnectionError", "APITimeoutError"), None
+    return status_code in RETRYABLE_STATUS_CODES, retry_after
+
+
+def raise_for_provider_status(response):
+    """
+    Raise a ProviderError for an unsuccessful provider HTTP response.
+
+    Args:
+    - response (requests.Response): The provider response.
+
+    Returns:
+    - requests.Response: The same response when it was successful.
+    """
+    if response.status_code >= 400:
+        raise ProviderError(
+            f"{response.request.method} {response.url} failed with {response.status_code}: {response.text[:200]}",
+            status_code=response.status_code,
+            retry_after=parse_retry_after(response.headers.get("retry-after")),
+        )
+    return response
+
+
+class ProviderScheduler:
+    """
+    Shared scheduler for provider calls with per-provider rate limits, retries and circuit breakers.
+    """
+
+    def __init__(self, limits=PROVIDER_LIMITS, max_retries=5, base_delay=1.0, max_delay=60.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.request_buckets = {}
+        self.unit_buckets = {}
+        self.breakers = {}
+        for provider, limit in limits.items():
+            self.request_buckets[provider] = TokenBucket(limit["requests_per_minute"])
+            if limit.get("units_per_minute"):
+                self.unit_buckets[provider] = TokenBucket(limit["units_per_minute"])
+            self.breakers[provider] = CircuitBreaker()
+
+    def call(self, provider, func, *args, units=0, **kwargs):
+        """
+        Run a provider call within its quota, retrying transient failures.
+
+        Retries use exponential backoff with full jitter, or the provider's
+        Retry-After delay when it gives one. While the provider's circuit is open,
+        calls wait for the cool-down instead of hitting the provider, and once it
+        is half-open only a single probe call reaches it.
+
+        Args:
+        - provider (str): Provider name, a key of PROVIDER_LIMITS.
+        - func (callable): The function performing the provider call.
+        - units (int): Tokens or characters consumed by the call.
+
+        Returns:
+        - Any: The value returned by func.
+        """
+        breaker = self.breakers[provider]
+        for attempt in range(self.max_retries + 1):
+            probe = breaker.acquire()
+            self.request_buckets[provider].acquire()
+            if units and provider in self.unit_buckets:
+                self.unit_buckets[provider].acquire(units)
+            try:
+                result = func(*args, **kwargs)
+            except BaseException as error:
+                retryable, retry_after = retry_info(error) if isinstance(error, Exception) else (False, None)
+                if retryable and getattr(error, "status_code", None) != 425:
+                    breaker.record_failure(probe)
+                else:
+                    # Ni un error definitivo ni un resultado aún no listo cuentan como fallo del proveedor
+                    breaker.release(probe)
+                if not retryable:
+                    raise
+                if attempt == self.max_retries:
+                    raise
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                if retry_after is not None:
+                    delay = retry_after + random.uniform(0, self.base_delay)
+                print(f"{provider} call failed ({error}); retrying in {delay:.1f} seconds...")
+                time.sleep(delay)
+            else:
+                breaker.record_success()
+                return result
+
+
+scheduler = ProviderScheduler()
@@ -0,0 +1,240 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+PARTIAL_PREFIX = ".partial-"  # Carpetas temporales de escrituras a medias; nunca se toman por resultados
+PARTIAL_MAX_AGE = 24 * 3600  # Segundos sin cambios tras los que una escritura a medias se da por abandonada
+SCENE_TIMES_DTYPE = np.dtype([("order", "<i4"), ("start", "<f8"), ("end", "<f8")])
+
+
+def fsync_file(path):
+    with open(path, "rb") as file:
+        os.fsync(file.fileno())
+
+
+@contextmanager
+def atomic_output(path):
+    """
+    Write a file, and any companion files written next to it, atomically.
+
+    The block gets a path with the same file name inside a hidden temporary folder
+    next to path. When the block succeeds, every file written in that folder is
+    moved into place with os.replace, the main file last, so a crash never leaves a
+    partial file under a final name and the main file (the one the pipeline's
+    os.path.exists checks look at) only appears once its companions are complete.
+
+    Args:
+    - path (str): Final path of the main file.
+
+    Returns:
+    - context manager yielding the temporary path to write to.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    name = os.path.basename(path)
+    temp_dir = tempfile.mkdtemp(prefix=PARTIAL_PREFIX, dir=directory)
+    try:
+        yield os.path.join(temp_dir, name)
+        # Mover primero los archivos acompañantes (versiones, póster, perfiles) y al final el principal
+        for entry in sorted(os.listdir(temp_dir), key=lambda entry: entry == name):
+            source = os.path.join(temp_dir, entry)
+            if os.path.isfile(source):
+                fsync_file(source)
+                os.replace(source, os.path.join(directory, entry))
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def remove_stale_partials(directory, max_age=PARTIAL_MAX_AGE):
+    """
+    Remove the temporary folders that atomic_output left behind when a run was killed mid-write.
+
+    A folder only counts as stale when neither it nor any file in it has changed for
+    max_age seconds, so writes still running in another worker on the same base path
+    are left alone.
+
+    Args:
+    - directory (str): Folder searched recursively.
+    - max_age (float): Seconds without changes after which a partial folder is removed.
+
+    Returns:
+    - list: Paths of the removed folders.
+    """
+    removed = []
+    cutoff = time.time() - max_age
+    for root, dirs, _ in os.walk(directory):
+        for name in [name for name in dirs if name.startswith(PARTIAL_PREFIX)]:
+            dirs.remove(name)  # No bajar a las carpetas temporales
+            path = os.path.join(root, name)
+            try:
+                entries = [path] + [os.path.join(path, entry) for entry in os.listdir(path)]
+                if max(os.path.getmtime(entry) for entry in entries) < cutoff:
+                    shutil.rmtree(path)
+                    removed.append(path)
+            except OSError:
+                continue  # Otro proceso la ha movido o borrado mientras tanto
+    return removed
+
+
+@contextmanager
+def atomic_write(path, mode="w"):
+    """
+    Open a file for writing that only replaces path once it has been written completely.
+
+    Args:
+    - path (str): Final path of the file.
+    - mode (str): "w" for UTF-8 text or "wb" for bytes.
+
+    Returns:
+    - context manager yielding the open file.
+    """
+    with atomic_output(path) as temp_path:
+        with open(temp_path, mode, encoding=None if "b" in mode else "utf-8") as file:
+            yield file
+
+
+def save_json(path, data):
+    """
+    Save data as compact JSON, atomically.
+    """
+    with atomic_write(path) as file:
+        json.dump(data, file, ensure_ascii=False, separators=(",", ":"))
+    return path
+
+
+def load_json(path):
+    """
+    Load a JSON file (compact or indented).
+    """
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def save_array(path, array):
+    """
+    Save a NumPy array as .npy, atomically.
+    """
+    with atomic_write(path, "wb") as file:
+        np.save(file, array)
+    return path
+
+
+def word_times_path(transcript_path):
+    """
+    Path of the word timestamps array stored next to a transcription JSON.
+    """
+    return os.path.splitext(transcript_path)[0] + "_words.npy"
+
+
+def scene_times_path(json_path):
+    """
+    Path of the scene times array stored next to a script JSON.
+    """
+    return os.path.splitext(json_path)[0] + "_scenes.npy"
+
+
+def word_times_array(segments):
+    """
+    Pack transcription words into a structured array with fixed-width "word" (UTF-8 bytes), "start" and "end" fields.
+
+    Args:
+    - segments (list): Words with "word", "start" and "end".
+
+    Returns:
+    - ndarray: One record per word.
+    """
+    words = [segment["word"].encode("utf-8") for segment in segments]
+    dtype = np.dtype([("word", f"S{max([1] + [len(word) for word in words])}"), ("start", "<f8"), ("end", "<f8")])
+    array = np.empty(len(segments), dtype=dtype)
+    array["word"] = words
+    array["start"] = [segment["start"] for segment in segments]
+    array["end"] = [segment["end"] for segment in segments]
+    return array
+
+
+def save_transcript(transcript_path, transcription_data):
+    """
+    Save a transcription as compact JSON plus a memory-mappable word timestamps array.
+
+    The array is written first, so a transcription JSON on disk always has its array.
+
+    Args:
+    - transcript_path (str): Path of the transcription JSON.
+    - transcription_data (dict): Transcription with "text" and "segments".
+
+    Returns:
+    - str: Path of the transcription JSON.
+    """
+    save_array(word_times_path(transcript_path), word_times_array(transcription_data["segments"]))
+    return save_json(transcript_path, transcription_data)
+
+
+def load_word_times(transcript_path, fields=None):
+    """
+    Memory-map the word timestamps of a transcription without parsing its JSON.
+
+    Transcriptions saved before the array existed are read from the JSON instead.
+
+    Args:
+    - transcript_path (str): Path of the transcription JSON.
+    - fields (list): Fields to return, e.g. ["start", "end"]; all of "word", "start" and "end" by default.
+
+    Returns:
+    - ndarray: Structured array with one record per word.
+    """
+    path = word_times_path(transcript_path)
+    array = np.load(path, mmap_mode="r") if os.path.exists(path) else word_times_array(load_json(transcript_path)["segments"])
+    return array[list(fields)] if fields else array
+
+
+def load_transcript_segments(transcript_path):
+    """
+    Load the words of a transcription as a list of dicts with "word", "start" and "end".
+    """
+    return [
+        {"word": word.decode("utf-8"), "start": float(start), "end": float(end)}
+        for word, start, end in load_word_times(transcript_path, ["word", "start", "end"])
+    ]
+
+
+def save_script(json_path, json_data):
+    """
+    Save a script JSON compactly, with its scene times also stored as a memory-mappable array when the scenes have them.
+
+    Args:
+    - json_path (str): Path of the script JSON.
+    - json_data (dict): JSON dictionary representing the TikTok video script.
+
+    Returns:
+    - str: Path of the script JSON.
+    """
+    scenes = json_data["scenes"]
+    if scenes and all("start" in scene and "end" in scene for scene in scenes):
+        array = np.array([(scene["order"], scene["start"], scene["end"]) for scene in scenes], dtype=SCENE_TIMES_DTYPE)
+        save_array(scene_times_path(json_path), array)
+    elif os.path.exists(scene_times_path(json_path)):
+        os.remove(scene_times_path(json_path))
+    return save_json(json_path, json_data)
+
+
+def load_scene_times(json_path):
+    """
+    Memory-map the scene times of a script without parsing its JSON.
+
+    Args:
+    - json_path (str): Path of the script JSON.
+
+    Returns:
+    - ndarray: Structured array with "order", "start" and "end" per scene, or None if the scenes have no times yet.
+    """
+    path = scene_times_path(json_path)
+    if os.path.exists(path):
+        return np.load(path, mmap_mode="r")
+    scenes = load_json(json_path)["scenes"]
+    if not scenes or not all("start" in scene and "end" in scene for scene in scenes):
+        return None
+    return np.array([(scene["order"], scene["start"], scene["end"]) for scene in scenes], dtype=SCENE_TIMES_DTYPE)
@@ -5,8 +5,14 @@ import threading
 import queue
 import io
 from main import main as main_pipeline
+from aux_funcs import sanitize_title
+from catalog_funcs import ProjectCatalog, catalog_path
+from provider_funcs import provider_names
+from store_funcs import atomic_write
 import sys
 
+GALLERY_PAGE_SIZE = 50
+
 # Cargar los JSON para los modelos de Leonardo y las voces de ElevenLabs
 leonardo_json_path = os.path.join(os.path.dirname(__file__), 'models', 'leonardo_models.json')
 elevenlabs_json_path = os.path.join(os.path.dirname(__file__), 'models','elevenlabs_voices.json')
@@ -39,7 +45,7 @@ class StreamToQueue(io.StringIO):
 def run_pipeline(base_path, prompt_path, leonardo_model, elevenlabs_voice, images_service, audio_service, add_music, add_subtitles, input_json, output_queue):
     # Save input JSON to a file
     input_json_path = os.path.join(base_path, "input.json")
-    with open(input_json_path, 'w', encoding='utf-8') as file:
+    with atomic_write(input_json_path) as file:
         json.dump(input_json, file, ensure_ascii=False, indent=4)
     
     # Capture stdout and stderr
@@ -57,7 +63,60 @@ def run_pipeline(base_path, prompt_path, leonardo_model, elevenlabs_voice, image
     
     output_queue.put(None)  # Sentinel to indicate the end of the process
 
+@st.cache_resource
+def load_catalog(path):
+    return ProjectCatalog(path)
+
+def gallery_view():
+    st.title('Project Gallery')
+
+    base_path = st.text_input('Base Path:', placeholder='path/to/your/folder', key="gallery_base_path_input")
+    if not base_path or not os.path.exists(catalog_path(base_path)):
+        st.info('No project catalog found under this base path yet.')
+        return
+    project_catalog = load_catalog(catalog_path(base_path))
+
+    # Solo se consulta la página visible, así la vista carga igual de rápido con miles de proyectos
+    search = st.text_input('Search titles:', key="gallery_search_input")
+    status = st.selectbox('Status:', ['any', 'done', 'failed'], key="gallery_status_input")
+    status = None if status == 'any' else status
+    total = project_catalog.count_projects(search=search, status=status)
+    pages = max(1, -(-total // GALLERY_PAGE_SIZE))
+    page = st.number_input(f'Page (of {pages}):', min_value=1, max_value=pages, value=1, key="gallery_page_input")
+    projects = project_catalog.list_projects(search=search, status=status, limit=GALLERY_PAGE_SIZE, offset=(page - 1) * GALLERY_PAGE_SIZE)
+
+    st.caption(f'{total} projects')
+    st.dataframe([
+        {
+            "Title": project["title"],
+            "Last stage": project["stage"],
+            "Status": project["status"],
+            "Duration (s)": round(project["duration"] or 0, 1),
+            "Size (MB)": round((project["size"] or 0) / 1e6, 1),
+            "Cost ($)": round(project["cost"] or 0, 4),
+        }
+        for project in projects
+    ], use_container_width=True)
+
+    if not projects:
+        return
+    keys = {project["title"]: project["key"] for project in projects}
+    selected = st.selectbox('Project:', list(keys), key="gallery_project_input")
+    project = project_catalog.get_project(keys[selected])
+    artifacts = {artifact["kind"]: artifact["path"] for artifact in project["artifacts"]}
+    if project["video_path"] and os.path.exists(project["video_path"]):
+        st.video(project["video_path"])
+    else:
+        st.warning('This project has no video yet.')
+    st.table([{"Step": stage["step"], "Stage": stage["name"], "Status": stage["status"], "Seconds": round(stage["seconds"] or 0, 2)} for stage in project["stages"]])
+    st.json(artifacts)
+
 def streamlit_app():
+    view = st.sidebar.radio('View:', ['Generate video', 'Gallery'], key="view_input")
+    if view == 'Gallery':
+        gallery_view()
+        return
+
     st.title('Video Generator')
     st.header('Enter video details')
 
@@ -72,14 +131,14 @@ def streamlit_app():
     # font_path is hardcoded in the auxiliary functions
 
     # User inputs for services and options
-    images_service = st.selectbox('Service for generating images:', ['openai', 'leonardo'], key="images_service_input")
+    images_service = st.selectbox('Service for generating images:', provider_names('image'), key="images_service_input")
     if images_service == 'leonardo':
         leonardo_model_option = st.selectbox('Leonardo Model:', leonardo_model_options, key="leonardo_model_input")
         leonardo_model = leonardo_model_ids[leonardo_model_option]
     else:
         leonardo_model = None
 
-    audio_service = st.selectbox('Service for generating audio:', ['openai', 'elevenlabs'], key="audio_service_input")
+    audio_service = st.selectbox('Service for generating audio:', provider_names('speech'), key="audio_service_input")
     if audio_service == 'elevenlabs':
         elevenlabs_voice_option = st.selectbox('ElevenLabs Voice ID:', elevenlabs_voice_options, key="elevenlabs_voice_input")
         elevenlabs_voice = elevenlabs_voice_ids[elevenlabs_voice_option]
@@ -121,19 +180,9 @@ def streamlit_app():
         if stderr_output:
             st.text_area('Errors', stderr_output, height=300)
 
-        # Display the generated video
-        video_dir = os.path.join(base_path, "data", "video", title.replace(" ", "_"))
-        base_video_path = os.path.join(video_dir, title.replace(' ', '_'))
-
-        video_path = None
-        if add_subtitles and add_music:
-            video_path = f"{base_video_path}_sub_music.mp4"
-        elif add_subtitles:
-            video_path = f"{base_video_path}_sub.mp4"
-        elif add_music:
-            video_path = f"{base_video_path}_music.mp4"
-        else:
-            video_path = f"{base_video_path}.mp4"
+        # Display the generated video (the catalog records the last video each step produced)
+        project = load_catalog(catalog_path(base_path)).get_project(sanitize_title(title))
+        video_path = project["video_path"] if project else None
 
         st.write(f"Looking for video at: {video_path}")
 